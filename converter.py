@@ -2,14 +2,19 @@
 A script to generate OpenMRS 3 forms from a metadata file in Excel.
 """
 
+import argparse
+import hashlib
 import json
+import math
 import os
 import re
 import time
-import uuid
+from concurrent.futures import ProcessPoolExecutor
 import openpyxl
 import pandas as pd
 from dotenv import load_dotenv
+import normalization
+from normalization import label_to_id, remove_prefixes
 
 # Load the environment variables
 load_dotenv(override=True)
@@ -32,6 +37,13 @@ EN = "en"
 # Since tooltip name is different in metadata, extract it form Configuration
 TOOLTIP_COLUMN_NAME = config.get("columns", {}).get("TOOLTIP_COLUMN_NAME")
 
+# Hash of the converter code, so that forms are regenerated when it changes
+converter_hash = hashlib.sha256()
+for converter_module in (__file__, normalization.__file__):
+    with open(converter_module, "rb") as f:
+        converter_hash.update(f.read())
+CONVERTER_FINGERPRINT = converter_hash.hexdigest()
+
 
 def read_excel_skip_strikeout(filepath, sheet_name=0, header_row=1):
     """
@@ -43,60 +55,342 @@ def read_excel_skip_strikeout(filepath, sheet_name=0, header_row=1):
     :param header_row: Which row in Excel is the header (1-based index)
     :return: Pandas DataFrame with rows containing strikethrough removed
     """
-    # Load workbook (use data_only=True if you only need computed values)
-    wb = openpyxl.load_workbook(filepath, data_only=True)
-    ws = wb[sheet_name]
+    # Load workbook (use data_only=True if you only need computed values) in
+    # read-only mode, so that rows are streamed instead of loaded all at once
+    wb = openpyxl.load_workbook(filepath, data_only=True, read_only=True)
+    try:
+        return worksheet_to_dataframe_skip_strikeout(
+            wb[sheet_name], sheet_name, header_row
+        )
+    finally:
+        wb.close()
 
-    # Convert 1-based to 0-based index for Python lists
-    header_idx = header_row - 1
 
-    # Grab all rows as openpyxl cell objects (not values_only=True,
-    # so we can read formatting info).
-    all_rows = list(ws.iter_rows())
+def iter_rows_skip_strikeout(rows, sheet_name, column_names):
+    """
+    Yields the values of each row that has no strikethrough formatting.
 
-    # Identify the header row cells and extract the column names
-    header_cells = all_rows[header_idx]
-    column_names = [cell.value for cell in header_cells]
-
-    data = []
-    # Iterate over the remaining rows after the header
-    for row_idx in range(header_idx + 1, len(all_rows)):
-        row_cells = all_rows[row_idx]
-        row_has_strike = False
-        row_values = []
-
-        for cell in row_cells:
-            # Check if the cell has a font and if that font uses strikethrough
-            if sheet_name == "OptionSets":
-                if cell.font and cell.font.strike:
-                    row_has_strike = True
-                    break  # No need to check other cells in this row
-            else:
-                question_cell = row_cells[column_names.index("Question")]
-                if question_cell.font and question_cell.font.strike:
-                    row_has_strike = True
-                    break  # No need to check other cells in this row
-            row_values.append(cell.value)
+    For the OptionSets sheet any struck out cell skips the row, for form
+    sheets only the "Question" cell is checked.
 
-        if not row_has_strike:
-            data.append(row_values)
+    :param rows: Iterator over rows of openpyxl cells, after the header
+    :param sheet_name: Name of the sheet, used to pick the strikeout rule
+    :param column_names: Column names from the header row
+    :return: Generator of lists of cell values
+    """
+    question_idx = None
+    for row_cells in rows:
+        # Check if the cell has a font and if that font uses strikethrough
+        if sheet_name == "OptionSets":
+            checked_cells = row_cells
+        else:
+            if question_idx is None:
+                question_idx = column_names.index("Question")
+            checked_cells = (row_cells[question_idx],)
+        if any(cell.font and cell.font.strike for cell in checked_cells):
+            continue
+        yield [cell.value for cell in row_cells]
+
+
+def worksheet_to_dataframe_skip_strikeout(ws, sheet_name, header_row=1):
+    """
+    Converts an already loaded worksheet to a DataFrame, skipping any row that
+    has strikethrough formatting. Rows are streamed, so only the cell values
+    of the kept rows are held in memory.
 
-    # Create a DataFrame from the filtered data
-    df = pd.DataFrame(data, columns=column_names)
+    :param ws: openpyxl worksheet to read
+    :param sheet_name: Name of the sheet, used to pick the strikeout rule
+    :param header_row: Which row in Excel is the header (1-based index)
+    :return: Pandas DataFrame with rows containing strikethrough removed
+    """
+    # Read cells (not values_only=True, so we can read formatting info),
+    # starting from the header row
+    rows = ws.iter_rows(min_row=header_row)
+
+    # Identify the header row cells and extract the column names
+    column_names = [cell.value for cell in next(rows)]
+
+    # Create a DataFrame from the filtered rows
+    df = pd.DataFrame(
+        list(iter_rows_skip_strikeout(rows, sheet_name, column_names)),
+        columns=column_names,
+    )
     return df
 
 
-# Adjust header to start from row 2
-# option_sets = pd.read_excel(METADATA_FILE, sheet_name='OptionSets', header=1)
-option_sets = read_excel_skip_strikeout(
-    filepath=METADATA_FILE, sheet_name="OptionSets", header_row=2
-)
+class MetadataWorkbook:
+    """
+    Metadata workbook opened a single time for a whole conversion run.
+
+    Every requested sheet is parsed (with strikeout filtering) while the
+    workbook is loaded, and the resulting DataFrames are then handed out on
+    demand without touching the Excel file again.
+    """
+
+    def __init__(self, filepath, sheet_names, header_row=1):
+        """
+        Load the workbook and parse the requested sheets.
+
+        Args:
+            filepath (str): Path to the Excel file.
+            sheet_names (list): Names of the sheets to parse.
+            header_row (int, optional): Header row (1-based). Defaults to 1.
+        """
+        self.filepath = filepath
+        self.header_row = header_row
+        self._dataframes = {}
+
+        wb = openpyxl.load_workbook(filepath, data_only=True, read_only=True)
+        try:
+            for sheet_name in dict.fromkeys(sheet_names):
+                self._dataframes[sheet_name] = worksheet_to_dataframe_skip_strikeout(
+                    wb[sheet_name], sheet_name, header_row
+                )
+        finally:
+            wb.close()
+
+    def get_sheet(self, sheet_name):
+        """
+        Get the strikeout-filtered DataFrame of a parsed sheet.
+
+        Args:
+            sheet_name (str): The name of the sheet.
+
+        Returns:
+            pandas.DataFrame: The sheet rows without struck out rows.
+        """
+        return self._dataframes[sheet_name]
+
+
 # List of sheets to process
 SHEETS = os.getenv("SHEETS_TO_PREVIEW", "F06-PHQ-9").split(",")
-print(SHEETS)
 
-# Define a global list to store all questions and answers
-ALL_QUESTIONS_ANSWERS = []
+
+def build_option_sets_index(option_sets_df):
+    """
+    Group the OptionSets sheet rows by option set name.
+
+    Args:
+        option_sets_df (pandas.DataFrame): The OptionSets sheet.
+
+    Returns:
+        dict: Option set name mapped to its answer records, in sheet order.
+    """
+    index = {}
+    for record in option_sets_df.to_dict(orient="records"):
+        option_set_name = record["OptionSet name"]
+        if pd.notnull(option_set_name):
+            index.setdefault(option_set_name, []).append(record)
+    return index
+
+
+# Parsed metadata shared by all forms, set by load_metadata()
+METADATA_WORKBOOK = None
+OPTION_SETS_INDEX = {}
+
+
+def load_metadata(sheets):
+    """
+    Open the metadata file once and parse the OptionSets and all form sheets,
+    then index the option sets so questions do not scan the whole sheet.
+
+    Args:
+        sheets (list): The form sheets to parse.
+    """
+    global METADATA_WORKBOOK, OPTION_SETS_INDEX
+    # Adjust header to start from row 2
+    METADATA_WORKBOOK = MetadataWorkbook(
+        filepath=METADATA_FILE, sheet_names=["OptionSets"] + sheets, header_row=2
+    )
+    OPTION_SETS_INDEX = build_option_sets_index(METADATA_WORKBOOK.get_sheet("OptionSets"))
+
+
+
+class QuestionAnswerRegistry:
+    """
+    Registry of all generated questions with their answers.
+
+    Keeps the ordered list of entries (as written to all_questions_answers.json)
+    together with hash indexes on question ID and (question ID, answer label),
+    so that skip logic resolution and ID de-duplication do not need to scan
+    every question generated so far.
+
+    Registrations and lookups can also be recorded as events, so that a form
+    generated elsewhere (in a worker process or in a previous run) can be
+    replayed and verified on top of this registry.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self._questions_by_id = {}
+        self._answer_concepts = {}
+        self._duplicate_counters = {}
+        self.events = None
+
+    def start_recording(self):
+        """
+        Start recording registrations and lookups in a new events list.
+        """
+        self.events = []
+
+    def _record(self, *event):
+        if self.events is not None:
+            self.events.append(list(event))
+
+    def add(self, question_id, question_label, answers):
+        """
+        Register a question and its answers.
+
+        Args:
+            question_id (str): The question ID.
+            question_label (str): The question label.
+            answers (list): The answers with their 'label' and 'concept'.
+        """
+        entry = {
+            "question_id": question_id,
+            "question_label": question_label,
+            "questionOptions": {"answers": answers},
+        }
+        self._record("add", question_id, question_label, answers)
+        self.entries.append(entry)
+        self._questions_by_id.setdefault(question_id, entry)
+        for answer in answers:
+            # The first registered question having that answer label wins
+            self._answer_concepts.setdefault(
+                (question_id, answer.get("label")), answer.get("concept")
+            )
+
+    def has_question_id(self, question_id):
+        """
+        Check if a question ID has already been registered.
+        """
+        return question_id in self._questions_by_id
+
+    def find_answer_concept(self, question_id, answer_label):
+        """
+        Find the concept of an answer by question ID and answer label.
+
+        Returns:
+            str: The answer concept, or None if not registered.
+        """
+        answer_concept = self._answer_concepts.get((question_id, answer_label))
+        self._record("find_answer_concept", question_id, answer_label, answer_concept)
+        return answer_concept
+
+    def deduplicate_id(self, cleaned_id):
+        """
+        Suffix an ID with '_1', '_2', ... until it no longer clashes with a
+        registered question ID.
+
+        Args:
+            cleaned_id (str): The cleaned ID.
+
+        Returns:
+            str: The first free ID.
+        """
+        deduplicated_id = self._find_free_id(cleaned_id)
+        self._record("deduplicate_id", cleaned_id, deduplicated_id)
+        return deduplicated_id
+
+    def _find_free_id(self, cleaned_id):
+        if not self.has_question_id(cleaned_id):
+            return cleaned_id
+        # Registered IDs are never removed, so suffixes found taken before
+        # are still taken and the search resumes from the last one
+        duplicate_count = self._duplicate_counters.get(cleaned_id, 1)
+        candidate_id = f"{cleaned_id}_{duplicate_count}"
+        while self.has_question_id(candidate_id):
+            duplicate_count += 1
+            candidate_id = f"{cleaned_id}_{duplicate_count}"
+        self._duplicate_counters[cleaned_id] = duplicate_count
+        return candidate_id
+
+    def replay(self, events):
+        """
+        Replay the events recorded by another registry.
+
+        Registrations are applied, and every recorded lookup is checked against
+        this registry. A mismatch means the recorded form would have been
+        generated differently on top of this registry.
+
+        Args:
+            events (list): The recorded events.
+
+        Returns:
+            bool: True if every lookup gave the same result.
+        """
+        for event in events:
+            if event[0] == "add":
+                self.add(*event[1:])
+            elif event[0] == "deduplicate_id":
+                if self.deduplicate_id(event[1]) != event[2]:
+                    return False
+            elif self.find_answer_concept(event[1], event[2]) != event[3]:
+                return False
+        return True
+
+    def rollback(self, entry_count):
+        """
+        Drop the entries registered after the first entry_count ones, and
+        stop recording events.
+        """
+        entries = self.entries[:entry_count]
+        del self.entries[:]
+        self._questions_by_id.clear()
+        self._answer_concepts.clear()
+        self._duplicate_counters.clear()
+        self.events = None
+        for entry in entries:
+            self.add(
+                entry["question_id"],
+                entry["question_label"],
+                entry["questionOptions"]["answers"],
+            )
+
+
+class QuestionsAnswersWriter:
+    """
+    Deferred writer for the all questions and answers artifact.
+
+    Instead of rewriting the file for every generated question, the registry
+    entries are flushed on demand (once per form). In 'jsonl' format, each
+    flush only appends the entries registered since the previous flush.
+    """
+
+    def __init__(self, registry, output_format="json"):
+        """
+        Args:
+            registry (QuestionAnswerRegistry): The registry to write.
+            output_format (str, optional): 'json' or 'jsonl'. Defaults to 'json'.
+        """
+        if output_format not in ("json", "jsonl"):
+            raise ValueError(f"Unsupported questions and answers format: {output_format}")
+        self.registry = registry
+        self.output_format = output_format
+        self.filepath = f"all_questions_answers.{output_format}"
+        self._entries_written = 0
+
+    def flush(self):
+        """
+        Write the registry entries to the artifact file.
+        """
+        entries = self.registry.entries
+        if self.output_format == "json":
+            with open(self.filepath, "w", encoding="utf-8") as file:
+                json.dump(entries, file, indent=2)
+        else:
+            mode = "a" if self._entries_written else "w"
+            with open(self.filepath, mode, encoding="utf-8") as file:
+                for entry in entries[self._entries_written :]:
+                    file.write(json.dumps(entry) + "\n")
+        self._entries_written = len(entries)
+
+
+# Define a global registry to store all questions and answers
+QUESTIONS_ANSWERS_REGISTRY = QuestionAnswerRegistry()
+QUESTIONS_ANSWERS_WRITER = QuestionsAnswersWriter(
+    QUESTIONS_ANSWERS_REGISTRY, config.get("QUESTIONS_ANSWERS_FORMAT", "json")
+)
 
 
 # Function to fetch options for a given option set
@@ -110,29 +404,32 @@ def get_options(option_set_name):
     Returns:
         list: A list of dictionaries containing option set details.
     """
-    return option_sets[option_sets["OptionSet name"] == option_set_name].to_dict(
-        orient="records"
-    )
+    return OPTION_SETS_INDEX.get(option_set_name, [])
 
 
-def find_question_concept_by_label(questions_answers, question_label):
+def find_question_concept_by_label(question_label):
     "Find question concept by label."
-    for question in questions_answers:
-        if question.get("question_id") == manage_id(question_label):
-            return question.get("question_id")
+    # Registered or not, the question concept is the managed ID of the label
     return manage_id(question_label)
 
 
-def find_answer_concept_by_label(questions_answers, question_id, answer_label):
+def find_answer_concept_by_label(registry, question_id, answer_label):
     "Find answer concept by label."
-    for question in questions_answers:
-        if question.get("question_id") == manage_id(question_id):
-            for answer in question.get("questionOptions").get("answers", []):
-                if answer.get("label") == answer_label:
-                    return answer.get("concept")
+    answer_concept = registry.find_answer_concept(manage_id(question_id), answer_label)
+    if answer_concept is not None:
+        return answer_concept
     return manage_id(answer_label)
 
 
+def is_missing(value):
+    """
+    Check if a cell value is empty, like pd.isnull() but for scalars only.
+    """
+    if value is None or value is pd.NaT or value is pd.NA:
+        return True
+    return isinstance(value, float) and math.isnan(value)
+
+
 def safe_json_loads(s):
     """
     Safe json loads.
@@ -203,7 +500,7 @@ def manage_label(original_label):
 
 # Manage IDs
 def manage_id(
-    original_id, id_type="question", question_id="None", all_questions_answers=None
+    original_id, id_type="question", question_id="None", registry=None
 ):
     """
     Manage IDs.
@@ -212,99 +509,29 @@ def manage_id(
         original_id (str): The original ID.
         id_type (str, optional): The ID type. Defaults to "question".
         question_id (str, optional): The question ID. Defaults to "None".
-        all_questions_answers (list, optional): A list of all questions and their answers.
-        Defaults to None.
+        registry (QuestionAnswerRegistry, optional): The registry of all questions
+        and their answers, used to de-duplicate IDs. Defaults to None.
 
     Returns:
         str: The cleaned ID.
     """
-    if all_questions_answers is None:
-        all_questions_answers = []
-    cleaned_id = remove_prefixes(original_id)
-    cleaned_id = re.sub(r"\s*\(.*?\)", "", cleaned_id)
-    # Replace "/" with "Or"
-    cleaned_id = re.sub(r"/", " Or ", cleaned_id)
-    if not detect_range_prefixes(cleaned_id):
-        # Replace "-" with a space
-        cleaned_id = re.sub(r"-", " ", cleaned_id)
-        # Replace "_" with a space
-        cleaned_id = re.sub(r"_", " ", cleaned_id)
-    # Replace "-"
-    cleaned_id = re.sub(r"-", "To", cleaned_id)
-    # Replace "<"
-    cleaned_id = re.sub(r"<", "Less Than", cleaned_id)
-    # Replace "<"
-    cleaned_id = re.sub(r">", "More Than", cleaned_id)
-    cleaned_id = camel_case(cleaned_id)
-    # Replace '+' characters with 'plus'
-    cleaned_id = re.sub(r"\+", "Plus", cleaned_id)
-    # Remove any other non-alphanumeric characters
-    cleaned_id = re.sub(r"[^a-zA-Z0-9_-]", "", cleaned_id)
-    # Remove leading and trailing underscores
-    cleaned_id = re.sub(r"^_+|_+$", "", cleaned_id)
-    # Replace multiple underscores with a single underscore
-    cleaned_id = re.sub(r"_+", "_", cleaned_id)
-    cleaned_id = cleaned_id[0].lower() + cleaned_id[1:]
+    # Label to ID conversion is memoized, only the duplicate suffix depends
+    # on the questions generated so far
+    cleaned_id = label_to_id(original_id)
     if id_type == "answer" and cleaned_id == "other":
         cleaned_id = str(question_id) + str(cleaned_id.capitalize())
-    if all_questions_answers is not None:
-        duplicate_count = 1
-        original_cleaned_id = cleaned_id
-        while any(q["question_id"] == cleaned_id for q in all_questions_answers):
-            cleaned_id = f"{original_cleaned_id}_{duplicate_count}"
-            duplicate_count += 1
+    if registry is not None:
+        cleaned_id = registry.deduplicate_id(cleaned_id)
     return cleaned_id
 
 
-def remove_prefixes(text):
-    """
-    Remove numerical prefixes from the beginning of the string.
-    Examples of prefixes: "1. ", "1.1 ", "1.1.1 ", etc.
-
-    Parameters:
-    text (str): The input string from which to remove prefixes.
-
-    Returns:
-    str: The string with the prefixes removed.
-    """
-    if not detect_range_prefixes(text):
-        # Convert text to string before using re.sub
-        text = str(text)
-        # Use re.sub to remove the matched prefix
-        text = re.sub(r"^\d+(\.\d+)*\s*", "", text)
-    return text
-
-
-def detect_range_prefixes(text):
-    """
-    Detect ranges in the beginning of the string.
-    """
-    pattern = r"(\d+-\d+|\> \d+|< \d+|\d+ - \d+|\d+-\d+)"
-    matches = re.findall(pattern, str(text))  # Convert text to string
-    return bool(matches)
-
-
-def camel_case(text):
-    """
-    Camel case a string.
-    """
-    words = text.split()
-    # If text is empty, return UUID
-    if not words or text == "%":
-        return str(uuid.uuid4())
-    # Convert the first word to lowercase and capitalize the rest of the words
-    camel_case_text = words[0].lower()
-    for word in words[1:]:
-        camel_case_text += word.capitalize()
-    return camel_case_text
-
-
-def build_skip_logic_expression(expression: str, questions_answers) -> str:
+def build_skip_logic_expression(expression: str, registry) -> str:
     """
     Build a skip logic expression from an expression string.
 
     Args:
         expression (str): An expression string.
+        registry (QuestionAnswerRegistry): The registry of all questions and answers.
 
     Returns:
         str: A skip logic expression.
@@ -331,15 +558,13 @@ def build_skip_logic_expression(expression: str, questions_answers) -> str:
         if re.match(uuid_pattern, original_question_label):
             question_id = original_question_label
         else:
-            question_id = find_question_concept_by_label(
-                questions_answers, original_question_label
-            )
+            question_id = find_question_concept_by_label(original_question_label)
         # Check if original_cond_answer is a 36 character UUID
         if re.match(uuid_pattern, original_cond_answer):
             cond_answer = original_cond_answer
         else:
             cond_answer = find_answer_concept_by_label(
-                questions_answers, original_question_label, original_cond_answer
+                registry, original_question_label, original_cond_answer
             )
         return f"{question_id} {operator} '{cond_answer}'"
 
@@ -497,76 +722,135 @@ def process_calculation(calculation, datatype="", concept_id=None):
         return {"calculateExpression": calculation}
 
 
-def generate_question(row, columns, question_translations):
+class QuestionRowLayout:
+    """
+    Column layout of a form sheet, resolved once per sheet.
+
+    Holds the position of every column used to build a question, so that rows
+    can be read as plain lists instead of pandas Series. Missing columns and
+    empty cells both read as None.
     """
-    Generate a question JSON from a row of the OptionSets sheet.
+
+    # Fields read from a form sheet row, and the column they are read from
+    FIELDS = {
+        "question": "Question",
+        "label_if_different": "Label if different",
+        "question_id": "Question ID",
+        "tooltip": TOOLTIP_COLUMN_NAME,
+        "external_id": "External ID",
+        "datatype": "Datatype",
+        "validation_format": "Validation (format)",
+        "mandatory": "Mandatory",
+        "rendering": "Rendering",
+        "lower_limit": "Lower limit",
+        "upper_limit": "Upper limit",
+        "default_value": "Default value",
+        "calculation": "Calculation",
+        "skip_logic": "Skip logic",
+        "option_set_name": "OptionSet name",
+        "section_translation": TRANSLATION_SECTION_COLUMN,
+        "question_translation": TRANSLATION_QUESTION_COLUMN,
+        "tooltip_translation": TRANSLATION_TOOLTIP_COLUMN,
+        "answer_translation": TRANSLATION_ANSWER_COLUMN,
+    }
+
+    def __init__(self, columns):
+        """
+        Args:
+            columns (list): The column names of the form sheet.
+        """
+        positions = {name: idx for idx, name in enumerate(columns)}
+        self.columns = columns
+        self.has_external_id = "External ID" in positions
+        self._positions = [
+            (field, positions[name])
+            for field, name in self.FIELDS.items()
+            if name is not None and name in positions
+        ]
+        self._empty_row = dict.fromkeys(self.FIELDS)
+
+    def read(self, values):
+        """
+        Read the fields of a row.
+
+        Args:
+            values (list): The cell values of the row.
+
+        Returns:
+            dict: The value of each field, None when missing or empty.
+        """
+        row = self._empty_row.copy()
+        for field, idx in self._positions:
+            value = values[idx]
+            if not is_missing(value):
+                row[field] = value
+        return row
+
+
+def clean_translation(translation):
+    """
+    Remove quotes and backslashes from a translation.
+    """
+    if translation is None:
+        return None
+    return translation.replace('"', "").replace("'", "").replace("\\", "/")
+
+
+def generate_question(values, layout, question_translations):
+    """
+    Generate a question JSON from a row of a form sheet.
 
     Args:
-        row (pandas.Series): A row of the OptionSets sheet.
-        columns (list): A list of column names in the OptionSets sheet.
+        values (list): The cell values of a row of the form sheet.
+        layout (QuestionRowLayout): The column layout of the form sheet.
+        question_translations (dict): The translations of the form.
 
     Returns:
         dict: A question JSON.
     """
+    row = layout.read(values)
 
-    if row.isnull().all() or pd.isnull(row["Question"]):
+    if row["question"] is None:
         return None  # Skip empty rows or rows with empty 'Question'
 
     # Manage values and default values
     original_question_label = (
-        row["Label if different"]
-        if "Label if different" in columns and pd.notnull(row["Label if different"])
-        else row["Question"]
+        row["label_if_different"]
+        if row["label_if_different"] is not None
+        else row["question"]
     )
 
-    question_label_translation = (
-        row[TRANSLATION_QUESTION_COLUMN]
-        .replace('"', "")
-        .replace("'", "")
-        .replace("\\", "/")
-        if TRANSLATION_QUESTION_COLUMN in columns
-        and pd.notnull(row[TRANSLATION_QUESTION_COLUMN])
-        else None
-    )
+    question_label_translation = clean_translation(row["question_translation"])
 
     question_label = manage_label(original_question_label)
     question_id = (
-        row["Question ID"]
-        if "Question ID" in columns and pd.notnull(row["Question ID"])
+        row["question_id"]
+        if row["question_id"] is not None
         else manage_id(original_question_label)
     )
 
-    original_question_info = (
-        row[TOOLTIP_COLUMN_NAME]
-        if TOOLTIP_COLUMN_NAME in columns and pd.notnull(row[TOOLTIP_COLUMN_NAME])
-        else None
-    )
-    question_info = manage_label(original_question_info)
+    question_info = manage_label(row["tooltip"])
 
     question_concept_id = (
-        row["External ID"]
-        if "External ID" in columns and pd.notnull(row["External ID"])
-        else question_id
+        row["external_id"] if row["external_id"] is not None else question_id
     )
 
     question_datatype = (
-        row["Datatype"].lower() if pd.notnull(row["Datatype"]) else "radio"
+        row["datatype"].lower() if row["datatype"] is not None else "radio"
     )
 
     validation_format = (
-        row["Validation (format)"]
-        if "Validation (format)" in columns and pd.notnull(row["Validation (format)"])
-        else ""
+        row["validation_format"] if row["validation_format"] is not None else ""
     )
 
     question_required = (
-        str(row["Mandatory"]).lower() == "true"
-        if "Mandatory" in columns and pd.notnull(row["Mandatory"])
+        str(row["mandatory"]).lower() == "true"
+        if row["mandatory"] is not None
         else False
     )
 
     question_rendering_value = (
-        row["Rendering"].lower() if pd.notnull(row["Rendering"]) else "text"
+        row["rendering"].lower() if row["rendering"] is not None else "text"
     )
 
     question_rendering = manage_rendering(question_rendering_value)
@@ -585,11 +869,11 @@ def generate_question(row, columns, question_translations):
 
     # Add min/max values if rendering is numeric/number
     if question_rendering in ["numeric", "number"]:
-        if "Lower limit" in columns and pd.notnull(row["Lower limit"]):
-            val = row["Lower limit"]
+        if row["lower_limit"] is not None:
+            val = row["lower_limit"]
             question_options["min"] = int(val) if type(val) == float else val
-        if "Upper limit" in columns and pd.notnull(row["Upper limit"]):
-            val = row["Upper limit"]
+        if row["upper_limit"] is not None:
+            val = row["upper_limit"]
             question_options["max"] = int(val) if type(val) == float else val
         if question_rendering_value == "decimalnumber":
             question_options["step"] = 0.01
@@ -630,94 +914,76 @@ def generate_question(row, columns, question_translations):
         )
 
     question_validators = safe_json_loads(validation_format)
-    if pd.notnull(question_validators):
+    if not is_missing(question_validators):
         question["validators"] = question_validators
 
-    if "Default value" in columns and pd.notnull(row["Default value"]):
-        question["default"] = row["Default value"]
+    if row["default_value"] is not None:
+        question["default"] = row["default_value"]
 
-    if TOOLTIP_COLUMN_NAME in columns and pd.notnull(row[TOOLTIP_COLUMN_NAME]):
+    if row["tooltip"] is not None:
         question["questionInfo"] = question_info
-        question_info_translation = (
-            row[TRANSLATION_TOOLTIP_COLUMN]
-            .replace('"', "")
-            .replace("'", "")
-            .replace("\\", "/")
-            if (
-                TRANSLATION_TOOLTIP_COLUMN in columns
-                and pd.notnull(row[TRANSLATION_TOOLTIP_COLUMN])
-            )
-            else None
-        )
+        question_info_translation = clean_translation(row["tooltip_translation"])
         add_translation(question_translations, question_info, question_info_translation)
 
-    if "Calculation" in columns and pd.notnull(row["Calculation"]):
-        calculation = row["Calculation"]
+    if row["calculation"] is not None:
+        calculation = row["calculation"]
         calculated_result = process_calculation(
             calculation, question_datatype, question_concept_id
         )
         if calculated_result:
             question_options["calculate"] = calculated_result
 
-    if "Skip logic" in columns and pd.notnull(row["Skip logic"]):
+    if row["skip_logic"] is not None:
         question["hide"] = {
             "hideWhenExpression": build_skip_logic_expression(
-                row["Skip logic"], ALL_QUESTIONS_ANSWERS
+                row["skip_logic"], QUESTIONS_ANSWERS_REGISTRY
             )
         }
 
-    if "OptionSet name" in columns and pd.notnull(row["OptionSet name"]):
-        options = get_options(row["OptionSet name"])
+    if row["option_set_name"] is not None:
+        options = get_options(row["option_set_name"])
         question["questionOptions"]["answers"] = []
         answers = []
 
         for opt in options:
+            # Manage Answer labels
             answer_label = manage_label(opt["Answers"])
+            # The Order column is optional, answers keep the sheet order
             order = (
-                int(manage_label(opt["Order"])) if opt["Order"] is not None else None
+                int(manage_label(opt["Order"]))
+                if opt.get("Order") is not None
+                else None
             )
             answer = {
-                "label": manage_label(opt["Answers"]),
+                "label": answer_label,
                 "order": order if order is not None else 0,
                 "concept": (
                     manage_id(opt["Answers"])
                     if opt["External ID"] == "#N/A"
                     else (
                         opt["External ID"]
-                        if "External ID" in columns and pd.notnull(opt["External ID"])
+                        if layout.has_external_id and not is_missing(opt["External ID"])
                         else manage_id(
                             opt["Answers"],
                             id_type="answer",
                             question_id=question_id,
-                            all_questions_answers=ALL_QUESTIONS_ANSWERS,
+                            registry=QUESTIONS_ANSWERS_REGISTRY,
                         )
                     )
                 ),
             }
             all_concept_ids.append(answer["concept"])
             answers.append(answer)
-            # Manage Answer labels
-            answer_label = manage_label(opt["Answers"])
-            translated_answer_label = (
-                row[TRANSLATION_ANSWER_COLUMN]
-                if TRANSLATION_ANSWER_COLUMN in columns
-                and pd.notnull(row[TRANSLATION_ANSWER_COLUMN])
-                else None
-            )
             add_translation(
-                question_translations, answer_label, translated_answer_label
+                question_translations, answer_label, row["answer_translation"]
             )
         question["questionOptions"]["answers"] = [
             {"label": x["label"], "concept": x["concept"]}
             for x in sorted(answers, key=lambda x: x["order"])
         ]
 
-        ALL_QUESTIONS_ANSWERS.append(
-            {
-                "question_id": question["id"],
-                "question_label": question["label"],
-                "questionOptions": {"answers": question["questionOptions"]["answers"]},
-            }
+        QUESTIONS_ANSWERS_REGISTRY.add(
+            question["id"], question["label"], question["questionOptions"]["answers"]
         )
 
     # Pop answers key if answers array is empty
@@ -727,10 +993,6 @@ def generate_question(row, columns, question_translations):
     ):
         question["questionOptions"].pop("answers")
 
-    # Rename the variable inside the 'with' statement
-    with open("all_questions_answers.json", "w", encoding="utf-8") as file:
-        json.dump(ALL_QUESTIONS_ANSWERS, file, indent=2)
-
     return question
 
 
@@ -757,55 +1019,52 @@ def generate_form(sheet_name, form_translations):
         "pages": [],
     }
 
-    # Adjust header to start from row 2 and keep Excel font formatting including strike out characters
-    # df = pd.read_excel(METADATA_FILE, sheet_name=sheet_name, header=1)
-    df = read_excel_skip_strikeout(
-        filepath=METADATA_FILE, sheet_name=sheet_name, header_row=2
-    )
+    # Sheets are parsed once when the workbook is opened, keeping Excel font
+    # formatting including strike out characters
+    df = METADATA_WORKBOOK.get_sheet(sheet_name)
 
     columns = df.columns.tolist()
 
     # concept_ids is defined here, not inside the function
     concept_ids_set = set()
 
-    pages = df["Page"].unique()
+    # Resolve the column layout once for all the rows of the sheet
+    layout = QuestionRowLayout(columns)
+
+    # Group the rows, as plain lists of values, by page and section in a single
+    # pass, keeping the order in which pages, sections and rows appear
+    group_numbers = df.groupby(["Page", "Section"], sort=False).ngroup().tolist()
+    sections = {}
+    for values, group_number in zip(df.to_numpy(dtype=object).tolist(), group_numbers):
+        if group_number >= 0:
+            sections.setdefault(group_number, []).append(values)
+
+    page_idx = columns.index("Page")
+    section_idx = columns.index("Section")
+    pages = {page: [] for page in df["Page"].unique()}
+    for section_rows in sections.values():
+        page, section = section_rows[0][page_idx], section_rows[0][section_idx]
+        pages.setdefault(page, []).append((section, section_rows))
 
     # Keep track of total questions and answers
     count_total_questions = 0
     count_total_answers = 0
 
-    for page in pages:
-        page_df = df[df["Page"] == page]
-
+    for page, sections in pages.items():
         form_data["pages"].append({"label": f"{page}", "sections": []})
         if page is not None:
             form_translations[page] = None
 
-        for section in page_df["Section"].unique():
-            section_df = page_df[page_df["Section"] == section]
-            section_label = (
-                section_df["Section"].iloc[0]
-                if pd.notnull(section_df["Section"].iloc[0])
-                else ""
-            )
-
+        for section_label, section_rows in sections:
             # Add section label translations to form_translations
-            section_label_translation = (
-                section_df[TRANSLATION_SECTION_COLUMN]
-                .iloc[0]
-                .replace('"', "")
-                .replace("'", "")
-                .replace("\\", "/")
-                if TRANSLATION_SECTION_COLUMN in columns
-                and pd.notnull(section_df[TRANSLATION_SECTION_COLUMN].iloc[0])
-                else None
+            section_label_translation = clean_translation(
+                layout.read(section_rows[0])["section_translation"]
             )
             form_translations[section_label] = section_label_translation
 
             questions = [
-                generate_question(row, columns, form_translations)
-                for _, row in section_df.iterrows()
-                if not row.isnull().all() and pd.notnull(row["Question"])
+                generate_question(values, layout, form_translations)
+                for values in section_rows
             ]
 
             questions = [q for q in questions if q is not None]
@@ -864,24 +1123,208 @@ def generate_translation_file(form_name, language, translations_list):
 
 # Generate forms and save as JSON
 OUTPUT_DIR = "./generated_form_schemas"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Manifest of the forms generated in previous runs, stored next to the outputs
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "conversion_manifest.json")
 
-# Load the data
-concepts = {}
+# Concept IDs of the form being generated
 all_concept_ids = []
-all_forms = []
-TOTAL_QUESTIONS = 0
-TOTAL_ANSWERS = 0
 
-# Start the timer
-start_time = time.time()
 
-for sheet in SHEETS:
+def get_output_file_paths(sheet):
+    """
+    Get the paths of the form and translation files generated for a sheet.
+    """
+    form_name_output = sheet.replace(" ", "_")
+    return [
+        os.path.join(OUTPUT_DIR, f"{form_name_output}.json"),
+        os.path.join(OUTPUT_DIR, f"{form_name_output}_translations_ar.json"),
+        os.path.join(OUTPUT_DIR, f"{form_name_output}_translations_en.json"),
+    ]
+
+
+def compute_form_fingerprint(sheet_name):
+    """
+    Compute a content hash of everything a form is generated from: the sheet
+    rows left after strikeout filtering, the OptionSets rows it references,
+    the converter settings and the converter code itself.
+
+    Args:
+        sheet_name (str): The name of the form sheet.
+
+    Returns:
+        str: The SHA-256 hex digest.
+    """
+    df = METADATA_WORKBOOK.get_sheet(sheet_name)
+    option_set_names = (
+        df["OptionSet name"].dropna().unique().tolist()
+        if "OptionSet name" in df.columns
+        else []
+    )
+    content = [
+        CONVERTER_FINGERPRINT,
+        TOOLTIP_COLUMN_NAME,
+        df.columns.tolist(),
+        df.values.tolist(),
+        [
+            [name, [list(record.values()) for record in get_options(name)]]
+            for name in option_set_names
+        ],
+    ]
+    return hashlib.sha256(
+        json.dumps(content, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def is_form_up_to_date(sheet, fingerprint, manifest):
+    """
+    Check if the files generated for a sheet in a previous run are up to date.
+    """
+    return manifest.get(sheet, {}).get("fingerprint") == fingerprint and all(
+        os.path.exists(path) for path in get_output_file_paths(sheet)
+    )
+
+
+def load_manifest():
+    """
+    Load the manifest of the forms generated in previous runs.
+    """
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def generate_form_serial(sheet_name):
+    """
+    Generate a form and its translations in the current process.
+
+    Args:
+        sheet_name (str): The name of the form sheet.
+
+    Returns:
+        dict: The form, its translations, its concept IDs and its total
+        number of questions and answers.
+    """
     all_concept_ids.clear()
     translations_data = {}
-    form, concept_ids, total_questions, total_answers = generate_form(
-        sheet, translations_data
+    form, _, total_questions, total_answers = generate_form(
+        sheet_name, translations_data
     )
+    return {
+        "form": form,
+        "translations": translations_data,
+        "concept_ids": list(all_concept_ids),
+        "total_questions": total_questions,
+        "total_answers": total_answers,
+    }
+
+
+def init_form_worker(metadata_workbook, option_sets_index):
+    """
+    Share the parsed metadata with a form generation worker process.
+    """
+    global METADATA_WORKBOOK, OPTION_SETS_INDEX
+    METADATA_WORKBOOK = metadata_workbook
+    OPTION_SETS_INDEX = option_sets_index
+
+
+def generate_form_job(sheet_name):
+    """
+    Generate a form in a worker process, on top of an empty registry that
+    records the registrations and lookups made for the form.
+
+    Args:
+        sheet_name (str): The name of the form sheet.
+
+    Returns:
+        dict: The generate_form_serial() results with the recorded registry
+        events.
+    """
+    global QUESTIONS_ANSWERS_REGISTRY
+    QUESTIONS_ANSWERS_REGISTRY = QuestionAnswerRegistry()
+    QUESTIONS_ANSWERS_REGISTRY.start_recording()
+    result = generate_form_serial(sheet_name)
+    result["events"] = QUESTIONS_ANSWERS_REGISTRY.events
+    return result
+
+
+def generate_forms(sheets, jobs=1, manifest=None):
+    """
+    Generate the forms of the given sheets, in sheet order.
+
+    Forms whose fingerprint did not change since the run recorded in the
+    manifest are not generated again. With more than one job, the other forms
+    are generated in a process pool. In both cases the recorded registry
+    events of the form are replayed on the global registry in sheet order, and
+    a form whose registry lookups give a different result on top of the
+    previous forms is regenerated in the main process. The output is
+    therefore identical to a full serial run.
+
+    Args:
+        sheets (list): The form sheets to generate.
+        jobs (int, optional): The number of worker processes. Defaults to 1.
+        manifest (dict, optional): The manifest of the previous run.
+
+    Yields:
+        tuple: The sheet name and its generate_form_serial() results, with
+        'form' and 'translations' set to None when the files are up to date,
+        and its 'fingerprint' and recorded registry 'events'.
+    """
+    registry = QUESTIONS_ANSWERS_REGISTRY
+    manifest = manifest or {}
+    fingerprints = {sheet: compute_form_fingerprint(sheet) for sheet in sheets}
+    dirty_sheets = [
+        sheet
+        for sheet in sheets
+        if not is_form_up_to_date(sheet, fingerprints[sheet], manifest)
+    ]
+
+    executor = None
+    worker_results = iter(())
+    if jobs > 1 and dirty_sheets:
+        executor = ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=init_form_worker,
+            initargs=(METADATA_WORKBOOK, OPTION_SETS_INDEX),
+        )
+        worker_results = executor.map(generate_form_job, dirty_sheets)
+
+    try:
+        for sheet in sheets:
+            entry_count = len(registry.entries)
+            registry.start_recording()
+            result = None
+            if sheet not in dirty_sheets:
+                result = dict(manifest[sheet], form=None, translations=None)
+            elif executor is not None:
+                result = next(worker_results)
+
+            if result is not None and not registry.replay(result["events"]):
+                print(f"Form {sheet} depends on previous forms, regenerating it")
+                registry.rollback(entry_count)
+                registry.start_recording()
+                result = None
+            if result is None:
+                result = generate_form_serial(sheet)
+
+            result["fingerprint"] = fingerprints[sheet]
+            result["events"] = registry.events
+            yield sheet, result
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def write_form_files(sheet, form, translations_data):
+    """
+    Write the form and its Arabic and English translation files.
+
+    Args:
+        sheet (str): The name of the form sheet.
+        form (dict): The form JSON.
+        translations_data (dict): The form translations.
+    """
     arabic_translations = generate_translation_file(sheet, "ar", translations_data)
     english_translations = generate_translation_file(sheet, "en", translations_data)
     json_data = json.dumps(form, indent=2)
@@ -925,25 +1368,84 @@ for sheet in SHEETS:
         print(
             f"JSON format error in translations form generated from sheet {sheet}: {e}"
         )
-    print("all_concept_ids", len(all_concept_ids))
-    concepts[sheet] = all_concept_ids
-    all_forms.append(form)
-    TOTAL_QUESTIONS += total_questions
-    TOTAL_ANSWERS += total_answers
 
-json.dump(concepts, open("concepts.json", "w"), indent=2)
 
-# Count the number of forms generated
-FORMS_GENERATED = len(SHEETS)
+def main():
+    """
+    Generate the forms of all sheets to preview and save them as JSON.
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate OpenMRS 3 forms from the metadata file."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of forms to generate in parallel processes (default: 1)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate all forms, even those whose sheet did not change",
+    )
+    args = parser.parse_args()
+
+    print(SHEETS)
+
+    # Start the timer
+    start_time = time.time()
+
+    # Load the data
+    load_metadata(SHEETS)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    manifest = {} if args.force else load_manifest()
+    concepts = {}
+    total_questions_all_forms = 0
+    total_answers_all_forms = 0
+
+    for sheet, result in generate_forms(SHEETS, args.jobs, manifest):
+        # Flush all questions and answers once per form
+        QUESTIONS_ANSWERS_WRITER.flush()
+        if result["form"] is None:
+            print(f"Form {sheet} is up to date, skipping it")
+            print()
+        else:
+            write_form_files(sheet, result["form"], result["translations"])
+        print("all_concept_ids", len(result["concept_ids"]))
+        concepts[sheet] = result["concept_ids"]
+        total_questions_all_forms += result["total_questions"]
+        total_answers_all_forms += result["total_answers"]
+        manifest[sheet] = {
+            key: result[key]
+            for key in (
+                "fingerprint",
+                "concept_ids",
+                "total_questions",
+                "total_answers",
+                "events",
+            )
+        }
+
+    with open("concepts.json", "w", encoding="utf-8") as f:
+        json.dump(concepts, f, indent=2)
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    # Count the number of forms generated
+    forms_generated = len(SHEETS)
+
+    # End the timer
+    end_time = time.time()
+
+    # Calculate the total time taken
+    total_time = end_time - start_time
 
-# End the timer
-end_time = time.time()
+    # Print the completion message with the number of forms generated
+    print("Forms generation completed!")
+    print(f"{forms_generated} forms generated in {total_time:.2f} seconds")
+    print(f"Total number of questions across all forms: {total_questions_all_forms}")
+    print(f"Total number of answers across all forms: {total_answers_all_forms}")
 
-# Calculate the total time taken
-total_time = end_time - start_time
 
-# Print the completion message with the number of forms generated
-print("Forms generation completed!")
-print(f"{FORMS_GENERATED} forms generated in {total_time:.2f} seconds")
-print(f"Total number of questions across all forms: {TOTAL_QUESTIONS}")
-print(f"Total number of answers across all forms: {TOTAL_ANSWERS}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+A script to benchmark the form generation throughput of converter.py, in rows
+per second, on the sheets to preview of the metadata file.
+"""
+
+import argparse
+import time
+import converter
+
+
+def benchmark_form(sheet_name, repeat):
+    """
+    Generate a form several times and measure its throughput.
+
+    Args:
+        sheet_name (str): The name of the form sheet.
+        repeat (int): The number of times the form is generated.
+
+    Returns:
+        tuple: The number of question rows and the rows generated per second.
+    """
+    df = converter.METADATA_WORKBOOK.get_sheet(sheet_name)
+    question_rows = int(df["Question"].notna().sum())
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        # Start every run from an empty registry, as in a fresh conversion
+        converter.QUESTIONS_ANSWERS_REGISTRY = converter.QuestionAnswerRegistry()
+        converter.all_concept_ids.clear()
+        converter.generate_form(sheet_name, {})
+    elapsed_time = time.perf_counter() - start_time
+
+    return question_rows, question_rows * repeat / elapsed_time
+
+
+def main():
+    """
+    Benchmark the generation of every sheet to preview.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the form generation of converter.py."
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=200,
+        help="Number of times each form is generated (default: 200)",
+    )
+    args = parser.parse_args()
+
+    converter.load_metadata(converter.SHEETS)
+    print(f"Metadata file: {converter.METADATA_FILE}")
+
+    total_rows = 0
+    total_time = 0
+    for sheet in converter.SHEETS:
+        question_rows, rows_per_second = benchmark_form(sheet, args.repeat)
+        print(f"{sheet}: {question_rows} rows, {rows_per_second:.0f} rows/second")
+        total_rows += question_rows * args.repeat
+        total_time += question_rows * args.repeat / rows_per_second
+
+    print(f"All forms: {total_rows / total_time:.0f} rows/second")
+
+
+if __name__ == "__main__":
+    main()
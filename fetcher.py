@@ -1,8 +1,20 @@
 "Fetcher to get concepts from OpenConceptLab API and save them to a JSON file."
 
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
+import glob
 import json
+import os
+import re
+import sys
+import threading
+import time
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
+from filter import filter_concept, write_snapshot
 
 # Load the configuration settings from config.json
 with open("config.json", "r", encoding="utf-8") as f:
@@ -10,59 +22,530 @@ with open("config.json", "r", encoding="utf-8") as f:
 
 # Extract the configuration settings
 FETCHER_BASE_URL = config.get("FETCHER_BASE_URL")
+# Number of concepts per page of the concept list
+FETCHER_PAGE_SIZE = config.get("FETCHER_PAGE_SIZE", 100)
+# Number of pages fetched in parallel
+FETCHER_CONCURRENCY = config.get("FETCHER_CONCURRENCY", 4)
+# Maximum number of requests per second to the OCL API, 0 for no limit
+FETCHER_RATE_LIMIT = config.get("FETCHER_RATE_LIMIT", 10)
+# Number of retries of the requests failing with a transient error
+FETCHER_MAX_RETRIES = config.get("FETCHER_MAX_RETRIES", 5)
+# Delay before the first retry in seconds, doubled at each retry
+FETCHER_BACKOFF = config.get("FETCHER_BACKOFF", 1)
+# Directory of the snapshots being downloaded and of their checkpoints, moved
+# to ocl_source_snapshots once complete
+FETCHER_DOWNLOAD_DIR = config.get(
+    "FETCHER_DOWNLOAD_DIR", "./ocl_source_snapshots/downloads"
+)
+# Raw and filtered snapshots of the source fetched by the fetcher, with the time
+# their download started
+SNAPSHOT_PATTERN = re.compile(r"MSF_Source_(\d{8}_\d{6})(_Filtered)?\.json$")
+# Status codes of the transient errors, when the API is busy or restarting
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Fields of the concept details that the verbose list responses should include,
+# the details of the concepts missing one of them being fetched one by one
+DETAIL_FIELDS = ("names", "descriptions", "extras", "mappings")
 
 
-def fetch_all_concepts(url, file_path):
-    "Fetch all concepts from the OpenConceptLab API and save them to a JSON file."
-    total_concepts = 0
-    page = 1
-    is_first_page = True
+class OCLClient:
+    """
+    Client of the concepts of an OCL source, sharing a pool of keep-alive
+    connections between the threads, with rate limiting and retries.
+    """
 
-    while True:
-        response = requests.get(f"{url}&page={page}", timeout=30)
-        if response.status_code == 200:
-            data = response.json()
-            total_concepts += len(data)
+    def __init__(
+        self, base_url, concurrency=FETCHER_CONCURRENCY, rate_limit=FETCHER_RATE_LIMIT
+    ):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        # Requests of all the threads are spaced by the interval of the rate limit
+        self.request_interval = 1 / rate_limit if rate_limit else 0
+        self.next_request_time = time.monotonic()
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.detail_requests = 0
 
+    def wait_for_rate_limit(self):
+        "Wait until the next request is allowed by the rate limit."
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_request_time - now
+            self.next_request_time = max(now, self.next_request_time) + (
+                self.request_interval
+            )
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def get(self, url):
+        """
+        Get a URL, retrying with an exponential backoff on the transient errors.
+
+        Returns:
+            requests.Response: The last response, successful or not.
+        """
+        for attempt in range(FETCHER_MAX_RETRIES + 1):
+            self.wait_for_rate_limit()
+            delay = FETCHER_BACKOFF * 2**attempt
+            try:
+                response = self.session.get(url, timeout=30)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt == FETCHER_MAX_RETRIES:
+                    raise
+                print(f"Request failed, retrying in {delay}s: {error}")
+            else:
+                if (
+                    response.status_code not in RETRY_STATUS_CODES
+                    or attempt == FETCHER_MAX_RETRIES
+                ):
+                    return response
+                # Follow the delay requested by the API when it throttles us
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = int(retry_after)
+                print(
+                    f"Status code {response.status_code} for {url},"
+                    f" retrying in {delay}s"
+                )
+            time.sleep(delay)
+        return response
+
+    def fetch_concept_details(self, concept):
+        "Fetch the details of a concept missing from the list response and add them."
+        concept_url = f"{self.base_url}/concepts/{concept['id']}/?includeMappings=true"
+        concept_response = self.get(concept_url)
+        if concept_response.status_code == 200:
+            concept.update(concept_response.json())
+        with self.lock:
+            self.detail_requests += 1
+
+    def fetch_page(self, page, updated_since=None):
+        """
+        Fetch a page of the concept list, with the details of its concepts.
+
+        Args:
+            page (int): The number of the page, from 1.
+            updated_since (str): Only list the concepts updated since this ISO
+                time, retired ones included, or all the concepts if None.
+
+        Returns:
+            list: The concepts of the page, empty after the last page.
+
+        Raises:
+            requests.HTTPError: If the page could not be fetched.
+        """
+        # Listing the concepts with their names, descriptions, extras and
+        # mappings
+        url = (
+            f"{self.base_url}/concepts/?q=&limit={FETCHER_PAGE_SIZE}"
+            f"&verbose=true&includeMappings=true&page={page}"
+        )
+        if updated_since:
+            url += f"&updatedSince={quote(updated_since)}&includeRetired=true"
+        response = self.get(url)
+        response.raise_for_status()
+        data = response.json()
+        for concept in data:
+            # The verbose list responses include the details of the concepts,
+            # only fetch them if some are missing
+            if any(field not in concept for field in DETAIL_FIELDS):
+                self.fetch_concept_details(concept)
+        return data
+
+
+def load_checkpoint(checkpoint_path, client, outputs, updated_since=None):
+    """
+    Load the checkpoint of an interrupted download of the source of a client,
+    or start a new one.
+
+    Returns:
+        dict: The start timestamp of the download, the number of pages and
+            concepts already written, and the size of each partial snapshot.
+    """
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r", encoding="utf-8") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        # Only resume the downloads of the same source with the same pages,
+        # to the same files, still holding all the pages written
+        if (
+            checkpoint["base_url"] == client.base_url
+            and checkpoint["page_size"] == FETCHER_PAGE_SIZE
+            and checkpoint["updated_since"] == updated_since
+            and sorted(checkpoint["offsets"]) == sorted(outputs)
+            and all(
+                os.path.exists(file_path) and os.path.getsize(file_path) >= offset
+                for file_path, offset in checkpoint["offsets"].items()
+            )
+        ):
+            return checkpoint
+        print("The interrupted download cannot be resumed, starting it again")
+    return {
+        "base_url": client.base_url,
+        "page_size": FETCHER_PAGE_SIZE,
+        "updated_since": updated_since,
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+        "pages": 0,
+        "concepts": 0,
+        "offsets": {file_path: 0 for file_path in outputs},
+    }
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    "Replace the checkpoint of a download at once, so that it is never partial."
+    with open(f"{checkpoint_path}.tmp", "w", encoding="utf-8") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+
+def wait_for_page(future):
+    """
+    Wait for a page being fetched.
+
+    Returns:
+        list: The concepts of the page, or None if it could not be fetched.
+    """
+    try:
+        return future.result()
+    except requests.RequestException as error:
+        if error.response is not None:
+            print(f"Failed to fetch data. Status code: {error.response.status_code}")
+        else:
+            print(f"Failed to fetch data: {error}")
+        return None
+
+
+def write_page(files, data, checkpoint):
+    """
+    Write the concepts of a page to each file, projected by its function, and
+    record their new size in the checkpoint.
+
+    Args:
+        files (dict): The open file and the function projecting the concepts
+            written to it, None to write them as fetched, by file path.
+        data (list): The concepts of the page.
+        checkpoint (dict): The checkpoint of the download.
+    """
+    for file_path, (file, projection) in files.items():
+        for index, concept in enumerate(data):
+            if checkpoint["concepts"] + index > 0:
+                file.write(",\n")
+            json.dump(projection(concept) if projection else concept, file)
+        file.flush()
+        checkpoint["offsets"][file_path] = file.tell()
+    checkpoint["concepts"] += len(data)
+
+
+def fetch_all_concepts(client, outputs, checkpoint_path, updated_since=None):
+    """
+    Fetch all concepts from the OpenConceptLab API and save them to JSON files.
+
+    Up to client.concurrency pages are fetched in parallel, and written to the
+    files in page order as they arrive, so that the whole source is never held
+    in memory. The pages written are recorded in the checkpoint file, so that
+    an interrupted download resumes after them. With updated_since, only the
+    concepts updated since then are fetched.
+
+    Args:
+        outputs (dict): The function projecting the concepts written to each
+            file, such as filter_concept, None to write them as fetched, by
+            file path.
+
+    Returns:
+        bool: Whether all the concepts were fetched.
+    """
+    checkpoint = load_checkpoint(checkpoint_path, client, outputs, updated_since)
+    page = checkpoint["pages"] + 1
+    pages = {}
+    if checkpoint["pages"]:
+        print(f"Resuming the download after page {checkpoint['pages']}")
+
+    with ExitStack() as stack:
+        files = {}
+        for file_path, projection in outputs.items():
+            file = stack.enter_context(open(file_path, "a", encoding="utf-8"))
+            # Drop what was written after the last complete page
+            file.truncate(checkpoint["offsets"][file_path])
+            if checkpoint["offsets"][file_path] == 0:
+                file.write("[\n")
+            files[file_path] = (file, projection)
+        save_checkpoint(checkpoint_path, checkpoint)
+
+        executor = stack.enter_context(ThreadPoolExecutor(client.concurrency))
+        while True:
+            # Keep fetching the next pages while waiting for the current one
+            while len(pages) < client.concurrency:
+                next_page = page + len(pages)
+                pages[next_page] = executor.submit(
+                    client.fetch_page, next_page, updated_since
+                )
+            # Stop at the first page that could not be fetched (None), or
+            # after the last page (empty)
+            data = wait_for_page(pages.pop(page))
             if not data:
                 break
 
-            with open(file_path, "a", encoding="utf-8") as file:
-                if is_first_page:
-                    file.write("[\n")
-                    is_first_page = False
-                else:
-                    file.write(",\n")
-                for i, concept in enumerate(data):
-                    concept_url = f"{FETCHER_BASE_URL}/concepts/{concept['id']}/"
-                    concept_response = requests.get(concept_url, timeout=30)
-                    if concept_response.status_code == 200:
-                        concept_details = concept_response.json()
-                        concept.update(concept_details)
-                    json.dump(concept, file)
-                    if i < len(data) - 1:
-                        file.write(",\n")
-            print(f"Total concepts found so far: {total_concepts}")
+            write_page(files, data, checkpoint)
+            checkpoint["pages"] = page
+            save_checkpoint(checkpoint_path, checkpoint)
+            print(f"Total concepts found so far: {checkpoint['concepts']}")
             page += 1
-        else:
-            print(f"Failed to fetch data. Status code: {response.status_code}")
-            break
 
+        # Do not wait for the pages after the last one
+        executor.shutdown(wait=False, cancel_futures=True)
+        if data is not None:
+            for file, _ in files.values():
+                file.write("\n]")
+
+    print(f"Total concepts found: {checkpoint['concepts']}")
+    print(f"Concepts whose details were fetched separately: {client.detail_requests}")
+    return data is not None
+
+
+def finalize_snapshot(file_path, snapshot_path):
+    "Move a complete download to its snapshot path at once."
     with open(file_path, "a", encoding="utf-8") as file:
-        file.write("\n]")
+        os.fsync(file.fileno())
+    os.replace(file_path, snapshot_path)
+
+
+def get_snapshot_path(timestamp, kind, directory="ocl_source_snapshots"):
+    "Get the path of the raw or the filtered snapshot downloaded at a time."
+    suffix = "_Filtered" if kind == "filtered" else ""
+    return os.path.join(directory, f"MSF_Source_{timestamp}{suffix}.json")
+
+
+def find_latest_snapshot(directory="ocl_source_snapshots"):
+    """
+    Find the newest snapshot of the source fetched by the fetcher.
+
+    Returns:
+        tuple: The time the download of the snapshot started, and the paths
+            of its raw and filtered versions, by kind, or None if there is no
+            snapshot.
+    """
+    snapshots = {}
+    for path in glob.glob(os.path.join(directory, "MSF_Source_*.json")):
+        match = SNAPSHOT_PATTERN.search(os.path.basename(path))
+        if match:
+            kind = "filtered" if match.group(2) else "raw"
+            snapshots.setdefault(match.group(1), {})[kind] = path
+    if not snapshots:
+        return None
+    timestamp = max(snapshots)
+    return datetime.strptime(timestamp, "%Y%m%d_%H%M%S"), snapshots[timestamp]
+
+
+def get_concept_key(concept):
+    "Identify a concept across snapshots by its ID, or its UUID if it has none."
+    return concept.get("id") or concept.get("uuid")
+
+
+def merge_snapshot(snapshot_path, delta_path, merged_path, projection=None):
+    """
+    Merge the concepts updated since a snapshot into a new snapshot.
+
+    The updated concepts replace their previous version in place, the new ones
+    are added at the end, and the retired ones are removed, as the full
+    snapshots do not include the retired concepts.
+
+    Args:
+        projection (function): Optional function projecting the concepts of
+            the snapshot like the updated ones, such as filter_concept.
+
+    Returns:
+        tuple: The number of concepts in the new snapshot, and the number of
+            concepts of the snapshot updated and retired, and of concepts added,
+            as (total, updated, added, retired).
+    """
+    with open(snapshot_path, "r", encoding="utf-8") as snapshot_file:
+        concepts = json.load(snapshot_file)
+    with open(delta_path, "r", encoding="utf-8") as delta_file:
+        updates = {
+            get_concept_key(concept): concept for concept in json.load(delta_file)
+        }
+
+    merged = []
+    updated = 0
+    retired = 0
+    for concept in concepts:
+        if projection:
+            concept = projection(concept)
+        update = updates.pop(get_concept_key(concept), None)
+        if concept.get("retired") and (update is None or update.get("retired")):
+            # Also drop the concepts retired before the snapshot, if any
+            continue
+        if update is None:
+            merged.append(concept)
+        elif update.get("retired"):
+            retired += 1
+        else:
+            merged.append(update)
+            updated += 1
+    # The remaining updates are the new concepts, unless created and retired
+    # since the snapshot
+    added = [concept for concept in updates.values() if not concept.get("retired")]
+    merged.extend(added)
+
+    # Write the new snapshot like the fetched ones, and move it at once
+    write_snapshot(merged_path, merged)
+    return len(merged), updated, len(added), retired
+
+
+def download(client, name, keep_raw, updated_since=None):
+    """
+    Download the concepts of a source to FETCHER_DOWNLOAD_DIR, resuming the
+    interrupted download of the same name if any, and exit if interrupted.
+
+    The concepts are filtered as they are fetched, and only kept as fetched
+    with keep_raw.
+
+    Returns:
+        tuple: The paths of the complete download by kind, "filtered" and
+            optionally "raw", the path of its checkpoint, to remove once the
+            download is saved, and the checkpoint.
+    """
+    # Download the concepts next to the snapshots, where an interrupted
+    # download is resumed from
+    os.makedirs(FETCHER_DOWNLOAD_DIR, exist_ok=True)
+    file_paths = {
+        "filtered": os.path.join(FETCHER_DOWNLOAD_DIR, f"{name}_Filtered.json.part")
+    }
+    if keep_raw:
+        file_paths["raw"] = os.path.join(FETCHER_DOWNLOAD_DIR, f"{name}.json.part")
+    checkpoint_path = os.path.join(FETCHER_DOWNLOAD_DIR, f"{name}.checkpoint.json")
+
+    # Fetch and save total concepts incrementally
+    outputs = {
+        file_path: filter_concept if kind == "filtered" else None
+        for kind, file_path in file_paths.items()
+    }
+    if not fetch_all_concepts(client, outputs, checkpoint_path, updated_since):
+        print("Download interrupted, run the fetcher again to resume it")
+        sys.exit(1)
+
+    with open(checkpoint_path, "r", encoding="utf-8") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    return file_paths, checkpoint_path, checkpoint
+
+
+def load_finalized_checkpoint(checkpoint_path):
+    """
+    Load the checkpoint of a complete download interrupted while being saved.
+
+    Returns:
+        dict: The checkpoint, or None if there is no such download.
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r", encoding="utf-8") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    return checkpoint if "finalized" in checkpoint else None
+
+
+def save_snapshots(file_paths, timestamp, latest_snapshots=None):
+    """
+    Move the files of a complete download to the snapshots, or merge them into
+    the latest snapshots when they only have the updated concepts.
+
+    The files already saved are skipped, so that saving a download again after
+    an interruption completes it.
+
+    Args:
+        file_paths (dict): The paths of the files of the download, by kind.
+        timestamp (str): The time the download started.
+        latest_snapshots (dict): The paths of the latest snapshots the
+            download has the updates of, by kind, None for a full download.
+    """
+    for kind, file_path in file_paths.items():
+        snapshot_path = get_snapshot_path(timestamp, kind)
+        if not os.path.exists(file_path):
+            continue
+        if latest_snapshots is None:
+            finalize_snapshot(file_path, snapshot_path)
+            print(f"Concepts saved to {snapshot_path}")
+            continue
+
+        # Filter the latest raw snapshot when it was not filtered yet
+        projection = None
+        base_path = latest_snapshots.get(kind)
+        if base_path is None and kind == "filtered":
+            base_path = latest_snapshots["raw"]
+            projection = filter_concept
+        if base_path is None:
+            print(f"No {kind} snapshot to merge the updated concepts into")
+        else:
+            total, updated, added, retired = merge_snapshot(
+                base_path, file_path, snapshot_path, projection
+            )
+            print(
+                f"Concepts saved to {snapshot_path}: {total} concepts,"
+                f" {updated} updated, {added} new, {retired} retired"
+            )
+        os.remove(file_path)
+
+
+def main():
+    "Fetch a snapshot of the source of FETCHER_BASE_URL."
+    parser = argparse.ArgumentParser(
+        description="Fetch a filtered snapshot of the concepts of an OCL source."
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Only fetch the concepts updated since the newest snapshot, and "
+        "merge them into a new snapshot",
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="Also save the concepts as fetched, before filtering",
+    )
+    args = parser.parse_args()
+    client = OCLClient(FETCHER_BASE_URL)
 
-    print(f"Total concepts found: {total_concepts}")
-    return total_concepts
+    # Finish saving a complete download interrupted while being saved, before
+    # looking for the latest snapshot, which it may have partly replaced
+    for name in ("MSF_Source", "MSF_Source_delta"):
+        checkpoint_path = os.path.join(FETCHER_DOWNLOAD_DIR, f"{name}.checkpoint.json")
+        checkpoint = load_finalized_checkpoint(checkpoint_path)
+        if checkpoint is not None:
+            print("Saving the download interrupted while being saved")
+            save_snapshots(**checkpoint["finalized"], timestamp=checkpoint["timestamp"])
+            os.remove(checkpoint_path)
+            return
 
+    latest_snapshot = find_latest_snapshot() if args.delta else None
+    if args.delta and latest_snapshot is None:
+        print("No snapshot to refresh, fetching all the concepts")
+    if latest_snapshot is None:
+        file_paths, checkpoint_path, checkpoint = download(
+            client, "MSF_Source", args.raw
+        )
+        latest_snapshots = None
+    else:
+        # The concepts updated during the download of the latest snapshot
+        # are fetched again
+        snapshot_time, latest_snapshots = latest_snapshot
+        updated_since = snapshot_time.astimezone().isoformat()
+        print(f"Fetching the concepts updated since {updated_since}")
+        file_paths, checkpoint_path, checkpoint = download(
+            client, "MSF_Source_delta", args.raw, updated_since
+        )
 
-# URL of the API without the page parameter
-API_URL = f"{FETCHER_BASE_URL}/concepts/?q=&limit=0"
+    # Save the fetched concepts to JSON files with the timestamp of the start
+    # of the download, only once complete. The checkpoint records what to save
+    # first, so that an interruption while saving is completed by the next run
+    checkpoint["finalized"] = {
+        "file_paths": file_paths,
+        "latest_snapshots": latest_snapshots,
+    }
+    save_checkpoint(checkpoint_path, checkpoint)
+    save_snapshots(file_paths, checkpoint["timestamp"], latest_snapshots)
+    os.remove(checkpoint_path)
+    print(f"Total number of concepts fetched: {checkpoint['concepts']}")
 
-# Save the fetched concepts to a JSON file with a timestamp
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-json_file_path = f"ocl_source_snapshots/MSF_Source_{timestamp}.json"
 
-# Fetch and save total concepts incrementally
-total_concepts_fetched = fetch_all_concepts(API_URL, json_file_path)
-print(f"Total number of concepts: {total_concepts_fetched}")
-print(f"Concepts saved to {json_file_path}")
+if __name__ == "__main__":
+    main()
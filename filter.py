@@ -1,19 +1,13 @@
 "Filter data needed for automatch script"
 
+import argparse
 import json
+import os
 
-# Define source and target file paths
-SOURCE_FILE = "ocl_source_snapshots/MSF_Source_20240717_220327.json"
-FILTERED_FILE = f"{SOURCE_FILE.split('.', maxsplit=1)[0]}_Filtered.json"
 
-# Load the JSON file
-with open(SOURCE_FILE, "r", encoding="utf-8") as file:
-    data = json.load(file)
-
-# Extract the required fields
-filtered_data = []
-for concept in data:
-    filtered_concept = {
+def filter_concept(concept):
+    "Keep only the fields of a concept needed by the automatch."
+    return {
         "uuid": concept.get("uuid"),
         "id": concept.get("id"),
         "external_id": concept.get("external_id"),
@@ -25,12 +19,64 @@ for concept in data:
         "organization": concept.get("organization"),
         "source": concept.get("source"),
         "owner": concept.get("owner"),
+        "retired": concept.get("retired"),
         "extras": concept.get("extras"),
         "names": concept.get("names"),
         "descriptions": concept.get("descriptions"),
     }
-    filtered_data.append(filtered_concept)
 
-# Save the filtered data to a new JSON file
-with open(FILTERED_FILE, "w", encoding="utf-8") as file:
-    json.dump(filtered_data, file, indent=4)
+
+def get_filtered_file(source_file):
+    "Get the path of the filtered version of a snapshot."
+    return f"{os.path.splitext(source_file)[0]}_Filtered.json"
+
+
+def write_snapshot(file_path, concepts):
+    """
+    Write concepts to a snapshot, one concept per line like the fetcher does,
+    replacing the file at once so that it is never partial.
+    """
+    with open(f"{file_path}.part", "w", encoding="utf-8") as file:
+        file.write("[\n")
+        file.write(",\n".join(json.dumps(concept) for concept in concepts))
+        file.write("\n]")
+    os.replace(f"{file_path}.part", file_path)
+
+
+def filter_snapshot(source_file, filtered_file=None):
+    """
+    Save the filtered version of a raw snapshot.
+
+    Returns:
+        str: The path of the filtered snapshot.
+    """
+    filtered_file = filtered_file or get_filtered_file(source_file)
+
+    # Load the JSON file
+    with open(source_file, "r", encoding="utf-8") as file:
+        data = json.load(file)
+
+    # Extract the required fields and save them to a new JSON file
+    write_snapshot(filtered_file, [filter_concept(concept) for concept in data])
+    return filtered_file
+
+
+def main():
+    "Filter the raw snapshot given on the command line."
+    parser = argparse.ArgumentParser(
+        description="Filter the fields of a raw OCL source snapshot needed by "
+        "the automatch. fetcher.py already saves filtered snapshots."
+    )
+    parser.add_argument("source_file", help="Raw snapshot of the OCL source")
+    parser.add_argument(
+        "--output",
+        help="Path of the filtered snapshot (default: the source file path "
+        "ending with _Filtered.json)",
+    )
+    args = parser.parse_args()
+    filtered_file = filter_snapshot(args.source_file, args.output)
+    print(f"Filtered snapshot saved to {filtered_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,9 @@ import os
 import math
 import time
 import openpyxl
-from rapidfuzz import process, fuzz
 import pandas as pd
 from dotenv import load_dotenv
+from matching import MatchCache, build_index, get_config, match_rows
 
 # Load the environment variables
 load_dotenv()
@@ -24,75 +24,19 @@ with open("config.json", "r", encoding="utf-8") as f:
 METADATA_FILEPATH = os.getenv("METADATA_FILEPATH", "./metadata_example.xlsx")
 # Load the OCL Concepts spreadsheet
 OCL_URL = config.get("OCL_URL", "https://app.openconceptlab.org/#")
-# Matching treshold for fuzzy matching
-FUZZY_THRESHOLD = config.get("FUZZY_THRESHOLD", 90)
+# Matching settings of the matching library, see matching.DEFAULT_CONFIG
+MATCH_CONFIG = get_config(config)
+# SQLite file caching the matches of the queries between runs, empty to disable
+MATCH_CACHE_FILEPATH = config.get("MATCH_CACHE_FILEPATH", "./match_cache.sqlite")
 # Output directory to save the generated form JSONs
 OUTPUT_DIR = config.get("OUTPUT_DIR", "./generated_form_schemas")
 # Get the list of sheets to process from the configuration settings
 SHEETS_TO_MATCH = os.getenv("SHEETS_TO_PREVIEW", "F06-PHQ-9").split(",")
-SHEETS = SHEETS_TO_MATCH.append("OptionSets")
+SHEETS = SHEETS_TO_MATCH + ["OptionSets"]
 
 # Columns names from the metadata spreadsheet
 automatch_references = config.get("automatch_references", {})
 
-# Initialize counters
-# Counter for total concepts to match
-TOTAL_ROWS_PROCESSED = 0
-
-# Initialize a dictionary to store the count of matches found per source
-matches_per_source = {}
-
-# Initialize a dictionary to store unique matches per row for all sheets
-unique_matches_per_row_all_sheets = {}
-
-# Start the timer to calculate the time taken to run the code
-start_time = time.time()
-
-
-# Find the best matches for each primary and secondary label in the metadata spreadsheet
-def find_best_matches(primary, secondary, data, threshold=FUZZY_THRESHOLD, limit=5):
-    """
-    Find the best matches for a primary and secondary value from a list of data.
-
-    :param primary: The primary value to search for
-    :param secondary: The secondary value to search for
-    :param data: List of dictionaries with 'id' (string) and 'display_name'
-    :param limit: The maximum number of matches to return
-    :return: List of tuples containing the id, match, score, and definition
-    """
-    # Initialize the list of best matches
-    results = []
-
-    # Combine the primary and secondary values into a single query string
-    query = f"{primary} {secondary}"
-
-    # Extract display_names from data for comparison
-    display_names = [item["display_name"] for item in data]
-
-    # Use rapidfuzz's process.extract to find the best matches with threshold
-    matches = process.extract(
-        query, display_names, scorer=fuzz.WRatio, score_cutoff=threshold, limit=limit
-    )
-
-    # Map the matches back to their corresponding IDs and definitions
-    for _, score, match_index in matches:
-        if score >= FUZZY_THRESHOLD:
-            results.append(
-                (
-                    data[match_index]["id"],
-                    data[match_index]["external_id"],
-                    data[match_index]["display_name"],
-                    data[match_index]["description"],
-                    data[match_index]["datatype"],
-                    data[match_index]["concept_class"],
-                    data[match_index]["url"],
-                    score,
-                )
-            )
-    # Return the list of results
-    return results
-
-
 # Open the metadata Excel file and find the column indices for the required columns
 def find_column_index(worksheet, column_name):
     """
@@ -113,159 +57,219 @@ def find_column_index(worksheet, column_name):
     return -1  # Return -1 if the column name is not found
 
 
-# Iterate through the sheets in df that are in the sheets list with headers on row 2
-for sheet_name in SHEETS:
-
-    df = pd.read_excel(METADATA_FILEPATH, sheet_name=sheet_name, header=1)
-    TOTAL_ROWS_PROCESSED += len(df)
-
-    # Iterate through each OCL source and look for suggestions for the primary and secondary lookups
-    for source_name, source_config in automatch_references.items():
-        print(f"Looking for suggestions in {source_name} source...")
-        SOURCE_FILEPATH = source_config["source_filepath"]
-
-        with open(SOURCE_FILEPATH, "r", encoding="UTF-8") as f:
-            json_data = json.load(f)
-            # Extract only the ID, display names, external IDs, datatype,
-            # concept_class, and extras > definitions from the JSON data
-            source_data = []
-            for item in json_data:
-                concept_id = item.get("id", "")
-                external_id = item.get("external_id")
-                display_name = item.get("display_name", "")
-                definition = (
-                    item.get("extras", {}).get("definition", "")
-                    if item.get("extras", {})
-                    else ""
-                )
-                description = (
-                    item.get("descriptions", [])[0].get("description", "")
-                    if item.get("descriptions", [])
-                    else definition
-                )
-                datatype = item.get("datatype")
-                concept_class = item.get("concept_class")
-                concept_url = item.get("URL")
-
-                # If no description is found, use the definition as the description
-                if description == "":
-                    description = definition
-
-                # Add the concept details to the source_data list
-                source_data.append(
-                    {
-                        "id": concept_id,
-                        "display_name": display_name,
-                        "definition": definition,
-                        "description": description,
-                        "datatype": datatype,
-                        "concept_class": concept_class,
-                        "external_id": external_id,
-                        "url": concept_url,
-                    }
-                )
-
-        # Load the Excel file, considering the header on row 2
-        df = pd.read_excel(METADATA_FILEPATH, sheet_name=sheet_name, header=1)
-        print(f"Processing sheet: {sheet_name}")
-
-        # Load the existing Excel file to append the suggestions
-        book = openpyxl.load_workbook(METADATA_FILEPATH)
-
-        # Using Excel Writer, append or update the details in the original existing
-        # Excel sheet and cells in the specified columns depending on the source name
-        with pd.ExcelWriter(METADATA_FILEPATH, engine="openpyxl", mode="a") as writer:
-            workbook = writer.book
-            ws = workbook[sheet_name]
-
-            # Get the column indices for the suggestion,
-            # external ID, description, datatype, concept class, and extras
-            suggestion_column = find_column_index(
-                ws, source_config["suggestion_column"]
-            )
-            external_id_column = find_column_index(
-                ws, source_config["external_id_column"]
-            )
-            description_column = find_column_index(
-                ws, source_config["description_column"]
+def load_source_indexes(references):
+    """
+    Load the snapshot of each OCL source to match against, once per run.
+
+    :param references: Dictionary of the OCL sources configurations, by name
+    :return: Dictionary of the ConceptIndex of each source, by name
+    """
+    indexes_by_filepath = {}
+    source_indexes = {}
+    for name, reference in references.items():
+        filepath = reference["source_filepath"]
+        # Sources sharing the same snapshot share the same index
+        if filepath not in indexes_by_filepath:
+            print(f"Loading {name} source snapshot: {filepath}")
+            indexes_by_filepath[filepath] = build_index(filepath, MATCH_CONFIG)
+        source_indexes[name] = indexes_by_filepath[filepath]
+    return source_indexes
+
+
+def save_suggestions(filepath, cells_by_sheet):
+    """
+    Write the suggestion cells to the metadata Excel file, saving it only once.
+
+    :param filepath: The path to the metadata Excel file
+    :param cells_by_sheet: Dictionary, by sheet name, of the values to write
+        by (row number, column name)
+    """
+    workbook = openpyxl.load_workbook(filepath)
+    for name, cells in cells_by_sheet.items():
+        ws = workbook[name]
+        column_indexes = {}
+        for (row, column_name), value in cells.items():
+            if column_name not in column_indexes:
+                column_indexes[column_name] = find_column_index(ws, column_name)
+            ws.cell(row=row, column=column_indexes[column_name]).value = value
+    workbook.save(filepath)
+
+
+def add_suggestion_cells(sheet_cells, row_number, source_config, match):
+    """
+    Add a suggestion to the cells to write, in the columns of its source.
+
+    :param sheet_cells: Dictionary of the values to write in the sheet, by
+        (row number, column name)
+    :param row_number: The number of the row of the suggestion in the sheet
+    :param source_config: The configuration of the OCL source
+    :param match: Dictionary of the matching concept details, as returned by
+        match_rows()
+    """
+    # Add URL concatenated with OCL_URL in Excel cell using =HYPERLINK() formula
+    sheet_cells[(row_number, source_config["suggestion_column"])] = (
+        f'=HYPERLINK("{OCL_URL}{match["url"]}", "{match["display_name"]}")'
+    )
+    for column, detail in (
+        ("external_id_column", "external_id"),
+        ("description_column", "description"),
+        ("datatype_column", "datatype"),
+        ("dataclass_column", "concept_class"),
+    ):
+        sheet_cells[(row_number, source_config[column])] = match[detail]
+    sheet_cells[(row_number, source_config["score_column"])] = math.ceil(match["score"])
+
+
+class MatchStatistics:
+    """
+    Statistics of the matches found by a run of the matcher.
+    """
+
+    def __init__(self):
+        # Counter for total concepts to match
+        self.total_rows_processed = 0
+        # Initialize a dictionary to store the count of matches found per source
+        self.matches_per_source = {}
+        # Initialize a dictionary to store unique matches per row for all sheets
+        self.unique_matches_per_row = {}
+
+    def add_row_match(self, sheet_name, index, source_name):
+        """
+        Count a row of a sheet for which a source has at least one match.
+
+        :param sheet_name: The name of the sheet
+        :param index: The index of the row in the sheet
+        :param source_name: The name of the OCL source
+        """
+        # Generate unique key using the row index and sheet name
+        # Replace spaces with underscores in the row index and sheet name
+        unique_row_key = f"{index}_{sheet_name.replace(' ', '_')}"
+        self.unique_matches_per_row[unique_row_key] = 1
+        # Update the count of matches found for the current source
+        self.matches_per_source[source_name] = (
+            self.matches_per_source.get(source_name, 0) + 1
+        )
+
+    @property
+    def total_unique_matches_found(self):
+        """
+        Number of rows with at least one match in any source.
+        """
+        return sum(self.unique_matches_per_row.values())
+
+
+def match_sheets(source_indexes, match_cache=None):
+    """
+    Match the rows of the sheets to preview against the OCL sources, and write
+    the suggestions to the metadata Excel file.
+
+    :param source_indexes: Dictionary of the ConceptIndex of each source, by name
+    :param match_cache: Optional MatchCache of the matches of previous runs
+    :return: The MatchStatistics of the run
+    """
+    statistics = MatchStatistics()
+
+    # Read the metadata Excel file once, the sheets being parsed as needed
+    metadata_file = pd.ExcelFile(METADATA_FILEPATH)
+
+    # Suggestion cells to write back to the metadata Excel file, by sheet
+    suggestion_cells = {}
+
+    # Iterate through the sheets in df that are in the sheets list with headers on row 2
+    for sheet_name in SHEETS:
+
+        # Load the sheet, considering the header on row 2
+        df = metadata_file.parse(sheet_name, header=1)
+        statistics.total_rows_processed += len(df)
+        sheet_cells = suggestion_cells.setdefault(sheet_name, {})
+        rows = [row for _, row in df.iterrows()]
+
+        # Iterate through each OCL source and look for suggestions
+        # for the primary and secondary lookups
+        for source_name, source_config in automatch_references.items():
+            print(f"Looking for suggestions in {source_name} source...")
+            print(f"Processing sheet: {sheet_name}")
+
+            # Get suggestions from each OCL source using closest match
+            # with RapidFuzz, scoring all the rows of the sheet at once
+            all_best_matches = match_rows(
+                rows, source_indexes[source_name], cache=match_cache
             )
-            datatype_column = find_column_index(ws, source_config["datatype_column"])
-            dataclass_column = find_column_index(ws, source_config["dataclass_column"])
-            score_column = find_column_index(ws, source_config["score_column"])
-
-            # Initialize a dictionary to store unique matches per row for the current sheet
-            unique_matches_per_row = {}
-
-            # Iterate through each row in the sheet and get
-            # the primary and secondary labels to match
-            for index, row in df.iterrows():
-
-                primary_lookup = row.get("Label if different") or None
-                secondary_lookup = row.get("Question") or row.get("Answers") or None
-
-                # Get suggestions from each OCL source using closest match
-                # with RapidFuzz using the primary lookup and secondary lookup
-                best_matches = find_best_matches(
-                    primary_lookup, secondary_lookup, source_data
-                )
-                # If at least one match is found, increment the MATCHES_FOUND counter by 1
-                # If at least one match is found, increment the MATCHES_FOUND counter by 1
+
+            # Iterate through each row in the sheet and its suggestions
+            for index, best_matches in zip(df.index, all_best_matches):
                 if len(best_matches) > 0:
-                    # If matches were found, add the unique row identifier to the dictionary
-                    # with a value of 1 only if the row identifier
-                    # is not already present in the dictionary
-                    # Generate unique key using the row index and sheet name
-                    # Replace spaces with underscores in the row index and sheet name
-                    UNIQUE_ROW_KEY = f"{index}_{sheet_name.replace(' ', '_')}"
-                    if UNIQUE_ROW_KEY not in unique_matches_per_row:
-                        # Generate unique key using the row index and sheet name
-                        unique_matches_per_row[UNIQUE_ROW_KEY] = 1
-                    # Update the count of matches found for the current source
-                    if source_name in matches_per_source:
-                        matches_per_source[source_name] += 1
-                    else:
-                        matches_per_source[source_name] = 1
-
-                # Add the suggestions to the Excel sheet
-                for m in best_matches:
-                    # Write the suggestion details to the Excel sheet
-                    # Add URL concatenated with OCL_URL in Excel cell using =HYPERLINK() formula
-                    ws.cell(row=index + 3, column=suggestion_column).value = (
-                        f'=HYPERLINK("{OCL_URL}{m[6]}", "{m[2]}")'
+                    statistics.add_row_match(sheet_name, index, source_name)
+
+                # Add the best suggestion to the cells to write, as the columns
+                # of a source only hold one suggestion per row
+                if best_matches:
+                    m = best_matches[0]
+                    add_suggestion_cells(sheet_cells, index + 3, source_config, m)
+                    print(
+                        f"Added suggestion: {m['display_name']} - {m['external_id']}"
+                        f" with score of {m['score']}"
                     )
-                    ws.cell(row=index + 3, column=external_id_column).value = m[1]
-                    ws.cell(row=index + 3, column=description_column).value = m[3]
-                    ws.cell(row=index + 3, column=datatype_column).value = m[4]
-                    ws.cell(row=index + 3, column=dataclass_column).value = m[5]
-                    ws.cell(row=index + 3, column=score_column).value = math.ceil(m[7])
-
-                    print(f"Added suggestion: {m[2]} - {m[1]} with score of {m[7]}")
-
-            # Close the Excel file writer
-            workbook.save(METADATA_FILEPATH)
-
-        # Add the unique_matches_per_row to the unique_matches_per_row_all_sheets dictionary
-        unique_matches_per_row_all_sheets.update(unique_matches_per_row)
-
-# Calculate the total number of unique matches found
-total_unique_matches_found = sum(unique_matches_per_row_all_sheets.values())
-
-# Calculate the percentage of matches found
-percentage_matches_found = (total_unique_matches_found / TOTAL_ROWS_PROCESSED) * 100
-rounded_percentage_matches_found = math.ceil(percentage_matches_found)
-
-# Calculate the time taken to run the code
-end_time = time.time()
-time_taken = end_time - start_time
-
-# Show the final statistics
-print("\nFinal Statistics:")
-print(f"Total row processed: {TOTAL_ROWS_PROCESSED}")
-print(f"Total unique matches found: {total_unique_matches_found}")
-print(f"Percentage of matches found: {rounded_percentage_matches_found}%")
-print(f"Sources used: {len(automatch_references)}")
-print("Matches per source:")
-for source_name, matches_per_source in matches_per_source.items():
-    print(f"{source_name} source: {matches_per_source} matches")
-rounded_time_taken = round(time_taken, 2)
-print(f"Time taken to run: {rounded_time_taken} seconds")
+
+    # Write all the suggestions to the metadata Excel file at once
+    metadata_file.close()
+    save_suggestions(METADATA_FILEPATH, suggestion_cells)
+    return statistics
+
+
+def main():
+    """
+    Run the matcher and show its final statistics.
+    """
+    # Start the timer to calculate the time taken to run the code
+    start_time = time.time()
+
+    # Load the concepts of every OCL source once, to be shared by all the sheets
+    source_indexes = load_source_indexes(automatch_references)
+
+    # Open the cache of the matches of the previous runs, forgetting the matches
+    # of the snapshots that are no longer used
+    match_cache = None
+    if MATCH_CACHE_FILEPATH:
+        match_cache = MatchCache(MATCH_CACHE_FILEPATH)
+        match_cache.prune({index.snapshot_hash for index in source_indexes.values()})
+
+    statistics = match_sheets(source_indexes, match_cache)
+
+    # Calculate the percentage of matches found
+    percentage_matches_found = (
+        statistics.total_unique_matches_found / statistics.total_rows_processed
+    ) * 100
+    rounded_percentage_matches_found = math.ceil(percentage_matches_found)
+
+    # Calculate the time taken to run the code
+    end_time = time.time()
+    time_taken = end_time - start_time
+
+    # Show the final statistics
+    print("\nFinal Statistics:")
+    print(f"Total row processed: {statistics.total_rows_processed}")
+    print(f"Total unique matches found: {statistics.total_unique_matches_found}")
+    print(f"Percentage of matches found: {rounded_percentage_matches_found}%")
+    print(f"Sources used: {len(automatch_references)}")
+    if match_cache is not None:
+        print(
+            f"Queries found in the match cache: {match_cache.hits}"
+            f" of {match_cache.hits + match_cache.misses}"
+        )
+        match_cache.close()
+    for source_name, source_index in source_indexes.items():
+        if source_index.blocking_recall is not None:
+            print(
+                f"{source_name} source blocking recall:"
+                f" {source_index.blocking_recall:.1%}"
+            )
+    print("Matches per source:")
+    for source_name, source_matches in statistics.matches_per_source.items():
+        print(f"{source_name} source: {source_matches} matches")
+    rounded_time_taken = round(time_taken, 2)
+    print(f"Time taken to run: {rounded_time_taken} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+A script to benchmark the matching library on a labeled fixture: metadata
+rows with the external ID of their concept in the MSF source snapshot, or none
+for the rows without any concept. It reports the throughput, the latency, the
+precision and recall of the suggestions, and the peak memory of each scorer
+and blocking configuration.
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+import numpy as np
+import matching
+
+# Names of the rapidfuzz scorers that can be benchmarked
+SCORERS = ("WRatio", "QRatio", "token_set_ratio", "token_sort_ratio")
+
+
+def load_fixture(filepath):
+    """
+    Load the labeled rows of the benchmark fixture.
+
+    Args:
+        filepath (str): The path to the JSON fixture.
+
+    Returns:
+        tuple: The metadata rows, as expected by matching.match_rows, and the
+            expected external ID of each row.
+    """
+    with open(filepath, "r", encoding="utf-8") as fixture_file:
+        fixture = json.load(fixture_file)
+    rows = [
+        {"Label if different": row["label"], "Question": row["question"]}
+        for row in fixture
+    ]
+    expected_ids = [row["external_id"] for row in fixture]
+    return rows, expected_ids
+
+
+def measure_quality(all_best_matches, expected_ids):
+    """
+    Measure the precision and recall of the suggestions.
+
+    Args:
+        all_best_matches (list): The suggestions of each row.
+        expected_ids (list): The expected external ID of each row.
+
+    Returns:
+        tuple: The share of the suggestions that are the expected concept, and
+            the share of the rows with a concept for which it is suggested.
+    """
+    suggestions = sum(len(best_matches) for best_matches in all_best_matches)
+    found = sum(
+        any(match["external_id"] == expected_id for match in best_matches)
+        for best_matches, expected_id in zip(all_best_matches, expected_ids)
+        if expected_id is not None
+    )
+    expected = sum(expected_id is not None for expected_id in expected_ids)
+    precision = found / suggestions if suggestions else 0
+    recall = found / expected if expected else 0
+    return precision, recall
+
+
+def benchmark_configuration(snapshot, rows, config, args):
+    """
+    Benchmark the matching of the fixture with a scorer and blocking method.
+
+    Args:
+        snapshot (str): The path to the source snapshot.
+        rows (list): The metadata rows of the fixture.
+        config (dict): The matching settings, with the scorer and the blocking
+            method to benchmark.
+        args (argparse.Namespace): The limit and repeat arguments.
+
+    Returns:
+        dict: The results of the benchmark.
+    """
+    # Peak memory of building the index and matching all the rows, measured
+    # apart as tracing the allocations slows the matching down
+    tracemalloc.start()
+    concept_index = matching.build_index(snapshot, config)
+    all_best_matches = matching.match_rows(rows, concept_index, args.limit)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Throughput of matching all the rows in a single batch
+    start_time = time.perf_counter()
+    for _ in range(args.repeat):
+        matching.match_rows(rows, concept_index, args.limit)
+    queries_per_second = len(rows) * args.repeat / (time.perf_counter() - start_time)
+
+    # Latency of matching the rows one at a time
+    latencies = []
+    for row in rows:
+        start_time = time.perf_counter()
+        matching.match_rows([row], concept_index, args.limit)
+        latencies.append(time.perf_counter() - start_time)
+
+    return {
+        "queries_per_second": queries_per_second,
+        "p50_ms": np.percentile(latencies, 50) * 1000,
+        "p95_ms": np.percentile(latencies, 95) * 1000,
+        "all_best_matches": all_best_matches,
+        "peak_memory_mb": peak_memory / 1024 / 1024,
+    }
+
+
+def main():
+    """
+    Benchmark every scorer and blocking configuration on the fixture.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the matching library on a labeled fixture."
+    )
+    parser.add_argument(
+        "--fixture",
+        default="matcher_benchmark_fixture.json",
+        help="Labeled metadata rows (default: matcher_benchmark_fixture.json)",
+    )
+    parser.add_argument(
+        "--snapshot",
+        default="ocl_source_snapshots/MSF_Source_20240717_165221_Filtered.json",
+        help="OCL source snapshot to match against (default: MSF snapshot)",
+    )
+    parser.add_argument(
+        "--scorers",
+        default=",".join(SCORERS),
+        help=f"Comma separated scorers (default: {','.join(SCORERS)})",
+    )
+    parser.add_argument(
+        "--blocking",
+        default="none,token,ngram",
+        help="Comma separated blocking methods (default: none,token,ngram)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="Minimum score of a match (default: FUZZY_THRESHOLD of config.json)",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=5,
+        help="Number of suggestions per row, the k of precision@k (default: 5)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of times the fixture is matched for throughput (default: 5)",
+    )
+    args = parser.parse_args()
+
+    # Benchmark the matching settings of config.json, but the scorer, the
+    # blocking method and the threshold
+    with open("config.json", "r", encoding="utf-8") as config_file:
+        config = matching.get_config(json.load(config_file))
+    if args.threshold is not None:
+        config["FUZZY_THRESHOLD"] = args.threshold
+
+    rows, expected_ids = load_fixture(args.fixture)
+    print(f"Fixture: {args.fixture} ({len(rows)} rows)")
+    print(f"Snapshot: {args.snapshot}")
+    print(f"Threshold: {config['FUZZY_THRESHOLD']}, k: {args.limit}")
+
+    for scorer_name in args.scorers.split(","):
+        if scorer_name not in SCORERS:
+            parser.error(f"Unknown scorer: {scorer_name}")
+        for blocking in args.blocking.split(","):
+            results = benchmark_configuration(
+                args.snapshot,
+                rows,
+                {
+                    **config,
+                    "MATCH_SCORER": scorer_name,
+                    "MATCH_BLOCKING": "" if blocking == "none" else blocking,
+                },
+                args,
+            )
+            precision, recall = measure_quality(
+                results["all_best_matches"], expected_ids
+            )
+            print(
+                f"{scorer_name}, blocking {blocking}:"
+                f" {results['queries_per_second']:.0f} queries/second,"
+                f" p50 {results['p50_ms']:.2f} ms, p95 {results['p95_ms']:.2f} ms,"
+                f" precision@{args.limit} {precision:.2f},"
+                f" recall@{args.limit} {recall:.2f},"
+                f" peak memory {results['peak_memory_mb']:.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
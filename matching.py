@@ -0,0 +1,735 @@
+"""
+Matching of metadata rows against the concepts of OCL source snapshots.
+
+The module has no side effects on import, so that a long-running process can
+build the index of each snapshot once and keep it in memory:
+
+    index = build_index("ocl_source_snapshots/MSF_Source_Filtered.json", config)
+    matches = match_rows([{"Question": "Nearly every day"}], index)
+
+The settings are read from a dictionary with the keys of config.json, see
+DEFAULT_CONFIG.
+"""
+
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import numpy as np
+from rapidfuzz import process, fuzz, utils
+from normalization import normalize_arabic, remove_prefixes
+
+# Default matching settings, overridden by the same keys in config.json
+DEFAULT_CONFIG = {
+    # Matching treshold for fuzzy matching
+    "FUZZY_THRESHOLD": 90,
+    # Name of the rapidfuzz.fuzz scorer used to compare the queries with the
+    # concept names
+    "MATCH_SCORER": "WRatio",
+    # Number of queries scored together against a source, which bounds the
+    # size of the score matrix (queries x names) held in memory
+    "MATCH_BATCH_SIZE": 256,
+    # Optional pre-filter of the names to score for each query: "token" or
+    # "ngram" to only score the names sharing the most words or character
+    # trigrams with the query, empty to score all the names
+    "MATCH_BLOCKING": "",
+    # Maximum number of names scored per query when blocking
+    "MATCH_BLOCKING_CANDIDATES": 300,
+    # Also score all the names to report the recall of the blocking
+    "MATCH_BLOCKING_RECALL": False,
+    # Normalization applied to the queries and to the concept names
+    "MATCH_NORMALIZATION": {
+        # Lowercase the text
+        "case_fold": True,
+        # Remove the numbering prefixes, such as "1.2 "
+        "remove_prefixes": True,
+        # Replace the punctuation and the other non alphanumeric characters
+        # with spaces
+        "remove_punctuation": True,
+        # Remove the Arabic diacritics and write the letter variants in one form
+        "normalize_arabic": True,
+        # Leave out the missing labels of the queries, and do not score empty
+        # queries
+        "skip_empty_queries": True,
+    },
+    # Locale of the labels of the metadata, matched against the names in this
+    # locale
+    "MATCH_DEFAULT_LOCALE": "en",
+    # OCL locales of the languages of the "Locale" column of the metadata,
+    # whose translations are matched against the names in the same locale
+    "MATCH_LOCALES": {"English": "en", "French": "fr", "Arabic": "ar"},
+    # Locale of the translations whose language is not specified
+    "MATCH_TRANSLATION_LOCALE": "ar",
+}
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[\W_]+")
+
+
+def get_config(config=None):
+    """
+    Complete matching settings with their default values.
+
+    :param config: Optional dictionary of settings, such as config.json
+    :return: Dictionary of the matching settings only
+    """
+    config = config or {}
+    settings = {key: config.get(key, value) for key, value in DEFAULT_CONFIG.items()}
+    settings["MATCH_NORMALIZATION"] = {
+        **DEFAULT_CONFIG["MATCH_NORMALIZATION"],
+        **settings["MATCH_NORMALIZATION"],
+    }
+    return settings
+
+
+def is_missing(value):
+    """
+    Check if a metadata value is missing, as None or NaN.
+    """
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def normalize_text(text, normalization):
+    """
+    Normalize a query or a concept name.
+
+    :param text: The text to normalize
+    :param normalization: Dictionary of the MATCH_NORMALIZATION steps to apply
+    :return: The normalized text
+    """
+    text = str(text)
+    if normalization["remove_prefixes"]:
+        text = remove_prefixes(text)
+    if normalization["normalize_arabic"]:
+        text = normalize_arabic(text)
+    if normalization["case_fold"] and normalization["remove_punctuation"]:
+        return utils.default_process(text)
+    if normalization["remove_punctuation"]:
+        text = NON_ALPHANUMERIC_PATTERN.sub(" ", text)
+    if normalization["case_fold"]:
+        text = text.lower()
+    return text.strip()
+
+
+def build_query(primary, secondary, skip_empty=True):
+    """
+    Combine the primary and secondary values into a single query string.
+
+    :param primary: The primary value to search for
+    :param secondary: The secondary value to search for
+    :param skip_empty: Leave out the missing values
+    :return: The query string
+    """
+    if not skip_empty:
+        return f"{primary} {secondary}"
+    return " ".join(
+        str(value) for value in (primary, secondary) if not is_missing(value)
+    )
+
+
+class BlockingIndex:
+    """
+    Inverted index of the words or character trigrams of preprocessed strings,
+    to find the few candidates worth scoring for a query.
+    """
+
+    def __init__(self, choices, method="ngram"):
+        """
+        :param choices: List of preprocessed strings, None for empty ones
+        :param method: "token" to index the words, "ngram" the character
+            trigrams of the words
+        """
+        if method not in ("token", "ngram"):
+            raise ValueError(f"Unknown blocking method: {method}")
+        self.method = method
+        self.size = len(choices)
+        postings = {}
+        for choice_index, choice in enumerate(choices):
+            for key in self.keys(choice or ""):
+                postings.setdefault(key, []).append(choice_index)
+        self.postings = {
+            key: np.array(indexes, dtype=np.int64) for key, indexes in postings.items()
+        }
+
+    def keys(self, text):
+        """
+        Get the distinct blocking keys of a preprocessed string.
+
+        :param text: The preprocessed string
+        :return: Set of the words or the character trigrams of the string
+        """
+        if self.method == "token":
+            return set(text.split())
+        keys = set()
+        for word in text.split():
+            # Pad the words so that the short ones still have a trigram
+            word = f" {word} "
+            keys.update(word[i : i + 3] for i in range(len(word) - 2))
+        return keys
+
+    def candidates(self, query, max_candidates):
+        """
+        Find the strings sharing the most blocking keys with a query.
+
+        :param query: The preprocessed query string
+        :param max_candidates: The maximum number of candidates to return
+        :return: Sorted array of the indexes of the candidate strings
+        """
+        postings = [
+            self.postings[key] for key in self.keys(query) if key in self.postings
+        ]
+        if not postings:
+            return np.array([], dtype=np.int64)
+        shared_keys = np.bincount(np.concatenate(postings), minlength=self.size)
+        candidates = np.flatnonzero(shared_keys)
+        if len(candidates) > max_candidates:
+            top = np.argpartition(-shared_keys[candidates], max_candidates - 1)
+            candidates = np.sort(candidates[top[:max_candidates]])
+        return candidates
+
+
+class ConceptIndex:
+    """
+    Index of the names of the concepts of an OCL source snapshot, by locale,
+    with the names preprocessed once for fuzzy matching.
+    """
+
+    def __init__(self, concepts, snapshot_hash=None, config=None):
+        """
+        :param concepts: List of dictionaries with the concept details and
+            their "names", as (name, locale) tuples
+        :param snapshot_hash: The content hash of the source snapshot
+        :param config: Optional dictionary of matching settings, see
+            DEFAULT_CONFIG
+        """
+        self.concepts = concepts
+        self.snapshot_hash = snapshot_hash
+        self.config = get_config(config)
+        blocking = self.config["MATCH_BLOCKING"]
+        # Preprocessed names of each locale and the concepts they belong to
+        choices = {}
+        choice_concepts = {}
+        for concept_index, concept in enumerate(concepts):
+            concept_choices = set()
+            for name, locale in concept["names"]:
+                if not name:
+                    continue
+                # Normalize once per name, instead of once per query
+                choice = normalize_text(name, self.config["MATCH_NORMALIZATION"])
+                if not choice or (choice, locale) in concept_choices:
+                    continue
+                concept_choices.add((choice, locale))
+                choices.setdefault(locale, []).append(choice)
+                choice_concepts.setdefault(locale, []).append(concept_index)
+        self.names = {
+            locale: (locale_choices, np.array(choice_concepts[locale], dtype=np.int64))
+            for locale, locale_choices in choices.items()
+        }
+        self.blocking_indexes = {
+            locale: BlockingIndex(locale_choices, blocking)
+            for locale, locale_choices in choices.items()
+            if blocking
+        }
+        # Matches found with and without blocking, when measuring its recall
+        self.blocking_matches = 0
+        self.full_scan_matches = 0
+
+    def __len__(self):
+        return len(self.concepts)
+
+    @property
+    def scorer(self):
+        """
+        The rapidfuzz scorer comparing the queries with the names.
+        """
+        return getattr(fuzz, self.config["MATCH_SCORER"])
+
+    @property
+    def scoring_method(self):
+        """
+        Describe how the queries are scored, as the matches depend on it.
+        """
+        normalization = ",".join(
+            step
+            for step, enabled in sorted(self.config["MATCH_NORMALIZATION"].items())
+            if enabled
+        )
+        scoring_method = f"{self.config['MATCH_SCORER']}/{normalization}"
+        if not self.config["MATCH_BLOCKING"]:
+            return scoring_method
+        return (
+            f"{scoring_method}/{self.config['MATCH_BLOCKING']}"
+            f"/{self.config['MATCH_BLOCKING_CANDIDATES']}"
+        )
+
+    @property
+    def blocking_recall(self):
+        """
+        Share of the matches of the full scan also found with blocking, or
+        None if it was not measured.
+        """
+        if not self.full_scan_matches:
+            return None
+        return self.blocking_matches / self.full_scan_matches
+
+    def query(self, query, limit=5, locale=None):
+        """
+        Find the concepts whose names best match a query.
+
+        :param query: The query string
+        :param limit: The maximum number of matches to return
+        :param locale: The locale of the query, MATCH_DEFAULT_LOCALE if None
+        :return: List of tuples containing the concept index and the score
+        """
+        locale = locale or self.config["MATCH_DEFAULT_LOCALE"]
+        return self.query_batch([(query, locale)], limit)[0]
+
+    def query_batch(self, queries, limit=5, cache=None):
+        """
+        Find the concepts whose names best match each of the queries, among
+        the names in the locale of the query.
+
+        The queries are scored against all the names at once with rapidfuzz's
+        cdist on all the CPU cores, in batches of MATCH_BATCH_SIZE queries, or
+        one by one against their candidates when blocking. The names of a
+        concept are collapsed into a single match with their best score. Each
+        distinct query is scored once, and only if its matches are not
+        already in the cache.
+
+        :param queries: List of (query string, locale) tuples
+        :param limit: The maximum number of matches to return per query
+        :param cache: Optional MatchCache of the matches of previous runs
+        :return: List, per query, of tuples containing the concept index and
+            the score, by decreasing score and then by concept order
+        """
+        normalization = self.config["MATCH_NORMALIZATION"]
+        processed_queries = [
+            (normalize_text(query, normalization), locale) for query, locale in queries
+        ]
+        matches_by_query = {}
+        if cache is not None:
+            matches_by_query = cache.get_matches(set(processed_queries), self, limit)
+        queries_by_locale = {}
+        for query, locale in dict.fromkeys(processed_queries):
+            if not query and normalization["skip_empty_queries"]:
+                matches_by_query[(query, locale)] = []
+            elif (query, locale) not in matches_by_query:
+                queries_by_locale.setdefault(locale, []).append(query)
+        scored_matches = {}
+        for locale, locale_queries in queries_by_locale.items():
+            for query, matches in self._score(locale_queries, locale, limit).items():
+                scored_matches[(query, locale)] = matches
+        if cache is not None:
+            cache.add_matches(scored_matches, self, limit)
+        matches_by_query.update(scored_matches)
+        return [matches_by_query[query] for query in processed_queries]
+
+    def _score(self, queries, locale, limit):
+        """
+        Score preprocessed queries against the names of a locale, or only
+        against their candidates when blocking.
+
+        :param queries: List of distinct preprocessed query strings
+        :param locale: The locale of the queries
+        :param limit: The maximum number of matches to return per query
+        :return: Dictionary of the matches of each query
+        """
+        if locale not in self.names:
+            return {query: [] for query in queries}
+        if not self.config["MATCH_BLOCKING"]:
+            return self._score_all(queries, locale, limit)
+        matches_by_query = self._score_candidates(queries, locale, limit)
+        if self.config["MATCH_BLOCKING_RECALL"]:
+            full_scan = self._score_all(queries, locale, limit)
+            for query, matches in full_scan.items():
+                found = {match_index for match_index, _ in matches_by_query[query]}
+                self.blocking_matches += sum(
+                    match_index in found for match_index, _ in matches
+                )
+                self.full_scan_matches += len(matches)
+        return matches_by_query
+
+    def _collapse(self, choice_indexes, scores, locale, limit):
+        """
+        Collapse the names matching a query into their concepts.
+
+        :param choice_indexes: The indexes of the matching names, sorted by
+            decreasing score and then by name order
+        :param scores: The scores of the matching names
+        :param locale: The locale of the names
+        :param limit: The maximum number of concepts to return
+        :return: List of tuples containing the concept index and its best score
+        """
+        matches = []
+        matched_concepts = set()
+        for choice_index, score in zip(choice_indexes, scores):
+            concept_index = int(self.names[locale][1][choice_index])
+            if concept_index in matched_concepts:
+                continue
+            matched_concepts.add(concept_index)
+            matches.append((concept_index, float(score)))
+            if len(matches) == limit:
+                break
+        return matches
+
+    def _score_all(self, queries, locale, limit):
+        """
+        Score preprocessed queries against all the names of a locale.
+
+        :param queries: List of distinct preprocessed query strings
+        :param locale: The locale of the queries
+        :param limit: The maximum number of matches to return per query
+        :return: Dictionary of the matches of each query
+        """
+        threshold = self.config["FUZZY_THRESHOLD"]
+        batch_size = self.config["MATCH_BATCH_SIZE"]
+        matches_by_query = {}
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start : start + batch_size]
+            scores = process.cdist(
+                batch,
+                self.names[locale][0],
+                scorer=self.scorer,
+                processor=None,
+                score_cutoff=threshold,
+                dtype=np.float64,
+                workers=-1,
+            )
+            for query, row_scores in zip(batch, scores):
+                matches = np.flatnonzero(row_scores >= threshold)
+                # Sort by decreasing score, then by name order for ties
+                matches = matches[np.lexsort((matches, -row_scores[matches]))]
+                matches_by_query[query] = self._collapse(
+                    matches, row_scores[matches], locale, limit
+                )
+        return matches_by_query
+
+    def _score_candidates(self, queries, locale, limit):
+        """
+        Score preprocessed queries against their blocking candidates only,
+        among the names of a locale.
+
+        :param queries: List of distinct preprocessed query strings
+        :param locale: The locale of the queries
+        :param limit: The maximum number of matches to return per query
+        :return: Dictionary of the matches of each query
+        """
+        matches_by_query = {}
+        for query in queries:
+            candidates = self.blocking_indexes[locale].candidates(
+                query, self.config["MATCH_BLOCKING_CANDIDATES"]
+            )
+            # The candidates are in name order, so are the ties
+            matches = process.extract(
+                query,
+                [self.names[locale][0][candidate] for candidate in candidates],
+                scorer=self.scorer,
+                processor=None,
+                score_cutoff=self.config["FUZZY_THRESHOLD"],
+                limit=None,
+            )
+            matches_by_query[query] = self._collapse(
+                [candidates[position] for _, _, position in matches],
+                [score for _, score, _ in matches],
+                locale,
+                limit,
+            )
+        return matches_by_query
+
+
+class MatchCache:
+    """
+    Persistent SQLite cache of the matches of the queries, so that only the
+    new or edited metadata rows are scored again on the next runs.
+
+    The matches are keyed by the preprocessed query and its locale, the
+    content hash of the source snapshot, the scoring method, the threshold and
+    the number of matches, so that fetching a new snapshot invalidates them.
+    """
+
+    # Version of the cached matches, to discard the caches of previous versions
+    VERSION = 2
+
+    def __init__(self, filepath):
+        """
+        :param filepath: The path to the SQLite cache file
+        """
+        self.connection = sqlite3.connect(filepath)
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != self.VERSION:
+            with self.connection:
+                self.connection.execute("DROP TABLE IF EXISTS matches")
+                self.connection.execute(f"PRAGMA user_version = {self.VERSION}")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS matches (
+                query TEXT NOT NULL,
+                locale TEXT NOT NULL,
+                snapshot_hash TEXT NOT NULL,
+                scorer TEXT NOT NULL,
+                threshold REAL NOT NULL,
+                max_matches INTEGER NOT NULL,
+                matches TEXT NOT NULL,
+                PRIMARY KEY (
+                    query, locale, snapshot_hash, scorer, threshold, max_matches
+                )
+            )
+            """
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get_matches(self, queries, concept_index, limit):
+        """
+        Get the cached matches of preprocessed queries in a concept index.
+
+        :param queries: Set of (preprocessed query string, locale) tuples
+        :param concept_index: The ConceptIndex the queries are matched against
+        :param limit: The maximum number of matches per query
+        :return: Dictionary of the matches of the queries found in the cache
+        """
+        cached_matches = {}
+        rows = self.connection.execute(
+            "SELECT query, locale, matches FROM matches WHERE snapshot_hash = ?"
+            " AND scorer = ? AND threshold = ? AND max_matches = ?",
+            (
+                concept_index.snapshot_hash,
+                concept_index.scoring_method,
+                concept_index.config["FUZZY_THRESHOLD"],
+                limit,
+            ),
+        )
+        for query, locale, matches in rows:
+            if (query, locale) in queries:
+                cached_matches[(query, locale)] = [
+                    tuple(match) for match in json.loads(matches)
+                ]
+        self.hits += len(cached_matches)
+        self.misses += len(queries) - len(cached_matches)
+        return cached_matches
+
+    def add_matches(self, matches_by_query, concept_index, limit):
+        """
+        Add the matches of preprocessed queries in a concept index.
+
+        :param matches_by_query: Dictionary of the matches of each
+            (preprocessed query string, locale) tuple
+        :param concept_index: The ConceptIndex the queries were matched against
+        :param limit: The maximum number of matches per query
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        query,
+                        locale,
+                        concept_index.snapshot_hash,
+                        concept_index.scoring_method,
+                        concept_index.config["FUZZY_THRESHOLD"],
+                        limit,
+                        json.dumps(matches),
+                    )
+                    for (query, locale), matches in matches_by_query.items()
+                ],
+            )
+
+    def prune(self, snapshot_hashes):
+        """
+        Remove the matches of the snapshots that are no longer used.
+
+        :param snapshot_hashes: The content hashes of the snapshots in use
+        """
+        placeholders = ", ".join("?" for _ in snapshot_hashes)
+        with self.connection:
+            self.connection.execute(
+                f"DELETE FROM matches WHERE snapshot_hash NOT IN ({placeholders})",
+                list(snapshot_hashes),
+            )
+
+    def close(self):
+        """
+        Close the connection to the cache file.
+        """
+        self.connection.close()
+
+
+def get_source_concepts(json_data, default_locale="en"):
+    """
+    Extract the details and the names of the concepts of an OCL source snapshot.
+
+    :param json_data: List of the concepts of the snapshot
+    :param default_locale: The locale of the display names without locale
+    :return: List of dictionaries with the concept details
+    """
+    # Extract only the ID, display names, external IDs, datatype,
+    # concept_class, and extras > definitions from the JSON data
+    source_data = []
+    for item in json_data:
+        display_name = item.get("display_name", "")
+        definition = (
+            item.get("extras", {}).get("definition", "")
+            if item.get("extras", {})
+            else ""
+        )
+        description = (
+            item.get("descriptions", [])[0].get("description", "")
+            if item.get("descriptions", [])
+            else definition
+        )
+        # Match against the display name and all the other names, synonyms
+        # and translations of the concept, in their locales
+        names = [(display_name, item.get("display_locale") or default_locale)]
+        names.extend(
+            (name.get("name"), name.get("locale"))
+            for name in item.get("names") or []
+        )
+
+        # Add the concept details to the source_data list, using the
+        # definition as the description if no description is found
+        source_data.append(
+            {
+                "id": item.get("id", ""),
+                "display_name": display_name,
+                "definition": definition,
+                "description": description or definition,
+                "datatype": item.get("datatype"),
+                "concept_class": item.get("concept_class"),
+                "external_id": item.get("external_id"),
+                "url": item.get("URL"),
+                "names": names,
+            }
+        )
+    return source_data
+
+
+def build_index(snapshot, config=None):
+    """
+    Build the concept index of an OCL source snapshot.
+
+    :param snapshot: The path to the JSON snapshot of the source, or the list
+        of its concepts
+    :param config: Optional dictionary of matching settings, see DEFAULT_CONFIG
+    :return: The ConceptIndex of the source
+    """
+    if isinstance(snapshot, list):
+        json_data = snapshot
+        content = json.dumps(snapshot, sort_keys=True).encode("UTF-8")
+    else:
+        with open(snapshot, "rb") as source_file:
+            content = source_file.read()
+        json_data = json.loads(content.decode("UTF-8"))
+    config = get_config(config)
+    concepts = get_source_concepts(json_data, config["MATCH_DEFAULT_LOCALE"])
+    return ConceptIndex(concepts, hashlib.sha256(content).hexdigest(), config)
+
+
+def get_translation_lookup(row, config):
+    """
+    Get the translation of the label of a metadata row and its locale.
+
+    :param row: The row of the metadata sheet
+    :param config: Dictionary of matching settings
+    :return: Tuple of the translation, None if there is none, and its locale
+    """
+    translation = row.get("Translation - Question")
+    if is_missing(translation):
+        translation = row.get("Translation")
+    if is_missing(translation) or not str(translation).strip():
+        return None, None
+    language = row.get("Locale")
+    if is_missing(language):
+        return str(translation), config["MATCH_TRANSLATION_LOCALE"]
+    return str(translation), config["MATCH_LOCALES"].get(
+        language, str(language).lower()
+    )
+
+
+def get_row_query(row, config):
+    """
+    Get the label of a metadata row to match, in the default locale.
+
+    :param row: The row of the metadata sheet
+    :param config: Dictionary of matching settings
+    :return: Tuple of the query string and its locale
+    """
+    return (
+        build_query(
+            row.get("Label if different") or None,
+            row.get("Question") or row.get("Answers") or None,
+            config["MATCH_NORMALIZATION"]["skip_empty_queries"],
+        ),
+        config["MATCH_DEFAULT_LOCALE"],
+    )
+
+
+def get_match_details(concept, score):
+    """
+    Get the details of a matching concept.
+
+    :param concept: The dictionary with the concept details
+    :param score: The score of the match
+    :return: Dictionary of the concept details and the score
+    """
+    return {
+        "id": concept["id"],
+        "external_id": concept["external_id"],
+        "display_name": concept["display_name"],
+        "description": concept["description"],
+        "datatype": concept["datatype"],
+        "concept_class": concept["concept_class"],
+        "url": concept["url"],
+        "score": score,
+    }
+
+
+def match_rows(rows, index, limit=5, cache=None):
+    """
+    Find the best matching concepts of metadata rows, scoring all of them in a
+    single batch.
+
+    The label of each row ("Label if different" followed by "Question" or
+    "Answers") is matched against the names in MATCH_DEFAULT_LOCALE, and its
+    translation ("Translation - Question" or "Translation", in the language of
+    "Locale") against the names in the locale of the translation. The
+    concepts matched by both keep their best score.
+
+    :param rows: List of the metadata rows, as dictionaries (or pandas Series)
+        by column name
+    :param index: The ConceptIndex of the source to search in
+    :param limit: The maximum number of matches to return per row
+    :param cache: Optional MatchCache of the matches of previous runs
+    :return: List, per row, of the dictionaries of the matching concepts, by
+        decreasing score and then by concept order
+    """
+    # Combine the primary and secondary values of each row into a single
+    # query string, followed by the translations to search for
+    queries = [get_row_query(row, index.config) for row in rows]
+    translated_rows = [
+        (row_index, translation)
+        for row_index, translation in enumerate(
+            get_translation_lookup(row, index.config) for row in rows
+        )
+        if translation[0] is not None
+    ]
+    row_count = len(queries)
+    queries.extend(query for _, query in translated_rows)
+    all_matches = index.query_batch(queries, limit, cache)
+
+    # Keep the best score of each concept across the query and its translation
+    best_scores = [dict(matches) for matches in all_matches[:row_count]]
+    for (row_index, _), matches in zip(translated_rows, all_matches[row_count:]):
+        for concept_index, score in matches:
+            if score > best_scores[row_index].get(concept_index, -1):
+                best_scores[row_index][concept_index] = score
+
+    # Map the matches back to their corresponding concept details
+    return [
+        [
+            get_match_details(index.concepts[concept_index], score)
+            for concept_index, score in sorted(
+                scores.items(), key=lambda match: (-match[1], match[0])
+            )[:limit]
+        ]
+        for scores in best_scores
+    ]
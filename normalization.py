@@ -0,0 +1,135 @@
+"""
+Normalization of metadata labels, shared by the form converter and the matcher.
+"""
+
+import re
+import uuid
+from functools import lru_cache
+
+# Precompiled patterns, in the order they are applied to build an ID
+RANGE_PREFIX_PATTERN = re.compile(r"(\d+-\d+|\> \d+|< \d+|\d+ - \d+|\d+-\d+)")
+NUMBERING_PREFIX_PATTERN = re.compile(r"^\d+(\.\d+)*\s*")
+PARENTHESES_PATTERN = re.compile(r"\s*\(.*?\)")
+NON_ID_CHARACTERS_PATTERN = re.compile(r"[^a-zA-Z0-9_-]")
+EDGE_UNDERSCORES_PATTERN = re.compile(r"^_+|_+$")
+MULTIPLE_UNDERSCORES_PATTERN = re.compile(r"_+")
+
+# Arabic diacritics (harakat, superscript alef) and tatweel, ignored when
+# comparing Arabic labels
+ARABIC_DIACRITICS_PATTERN = re.compile(r"[\u064B-\u0652\u0670\u0640]")
+# Arabic letters written interchangeably, mapped to a single form
+ARABIC_LETTER_VARIANTS = str.maketrans(
+    {
+        "\u0622": "\u0627",  # Alef with madda
+        "\u0623": "\u0627",  # Alef with hamza above
+        "\u0625": "\u0627",  # Alef with hamza below
+        "\u0671": "\u0627",  # Alef wasla
+        "\u0649": "\u064A",  # Alef maksura
+        "\u0629": "\u0647",  # Teh marbuta
+    }
+)
+
+# Number of distinct labels kept in the label to ID cache
+LABEL_TO_ID_CACHE_SIZE = 10000
+
+
+def detect_range_prefixes(text):
+    """
+    Detect ranges in the beginning of the string.
+    """
+    return RANGE_PREFIX_PATTERN.search(str(text)) is not None
+
+
+def remove_prefixes(text):
+    """
+    Remove numerical prefixes from the beginning of the string.
+    Examples of prefixes: "1. ", "1.1 ", "1.1.1 ", etc.
+
+    Parameters:
+    text (str): The input string from which to remove prefixes.
+
+    Returns:
+    str: The string with the prefixes removed.
+    """
+    if not detect_range_prefixes(text):
+        # Convert text to string before removing the matched prefix
+        text = NUMBERING_PREFIX_PATTERN.sub("", str(text))
+    return text
+
+
+def normalize_arabic(text):
+    """
+    Normalize the Arabic letters of a string, removing the diacritics and the
+    tatweel, and writing the alef, yeh and teh marbuta variants in one form.
+
+    Parameters:
+    text (str): The input string to normalize.
+
+    Returns:
+    str: The normalized string.
+    """
+    return ARABIC_DIACRITICS_PATTERN.sub("", str(text)).translate(
+        ARABIC_LETTER_VARIANTS
+    )
+
+
+def camel_case(text):
+    """
+    Camel case a string.
+    """
+    words = text.split()
+    # If text is empty, return UUID
+    if not words or text == "%":
+        return str(uuid.uuid4())
+    # Convert the first word to lowercase and capitalize the rest of the words
+    return words[0].lower() + "".join(word.capitalize() for word in words[1:])
+
+
+@lru_cache(maxsize=LABEL_TO_ID_CACHE_SIZE, typed=True)
+def _label_to_id(label):
+    """
+    Memoized core of label_to_id(), returning None for labels without words.
+    """
+    cleaned_id = remove_prefixes(label)
+    cleaned_id = PARENTHESES_PATTERN.sub("", cleaned_id)
+    # Replace "/" with "Or"
+    cleaned_id = cleaned_id.replace("/", " Or ")
+    if not detect_range_prefixes(cleaned_id):
+        # Replace "-" and "_" with a space
+        cleaned_id = cleaned_id.replace("-", " ").replace("_", " ")
+    # Replace "-", "<" and ">"
+    cleaned_id = cleaned_id.replace("-", "To")
+    cleaned_id = cleaned_id.replace("<", "Less Than")
+    cleaned_id = cleaned_id.replace(">", "More Than")
+    if not cleaned_id.split() or cleaned_id == "%":
+        return None
+    cleaned_id = camel_case(cleaned_id)
+    # Replace '+' characters with 'plus'
+    cleaned_id = cleaned_id.replace("+", "Plus")
+    # Remove any other non-alphanumeric characters
+    cleaned_id = NON_ID_CHARACTERS_PATTERN.sub("", cleaned_id)
+    # Remove leading and trailing underscores
+    cleaned_id = EDGE_UNDERSCORES_PATTERN.sub("", cleaned_id)
+    # Replace multiple underscores with a single underscore
+    cleaned_id = MULTIPLE_UNDERSCORES_PATTERN.sub("_", cleaned_id)
+    return cleaned_id[0].lower() + cleaned_id[1:]
+
+
+def label_to_id(label):
+    """
+    Convert a question or answer label to a camel cased ID.
+
+    The conversion is memoized, as the same labels ("Yes", "No", "Other", ...)
+    recur across questions and forms. Labels without any word get a random
+    UUID, which is generated outside of the cache.
+
+    Args:
+        label (str): The label.
+
+    Returns:
+        str: The ID.
+    """
+    cleaned_id = _label_to_id(label)
+    if cleaned_id is None:
+        return str(uuid.uuid4())
+    return cleaned_id